@@ -0,0 +1,104 @@
+# -*- encoding: utf8 -*-
+
+import calendar
+
+from datetime import date
+from fractions import Fraction
+
+
+# Money inside the ledger is kept as an integer number of hundredths
+CENTS = 100
+
+
+def to_cents(amount):
+    return int(round(amount * CENTS))
+
+
+def from_cents(cents):
+    # Whole amounts come back as ints, so the panels show them as before
+    whole, rest = divmod(cents, CENTS)
+    return cents / CENTS if rest else whole
+
+
+def month_number(d):
+    return d.year * 12 + d.month - 1
+
+
+def accrual_date(month_no, day):
+    # Interest is paid on the instrument's day, or on the last day of
+    # shorter months
+    year, month = divmod(month_no, 12)
+    month += 1
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+class RateHistory(object):
+    # Monthly rates plus a cumulative growth index, so the growth over any
+    # span of months is a single division. Months after the last known
+    # rate are projected with that rate.
+    __slots__ = ('first', 'rates', 'index')
+
+    def __init__(self, start, rate):
+        self.first = month_number(start)
+        self.rates = [rate]
+        self.index = [Fraction(1)]
+
+    def set_rate(self, d, rate):
+        k = max(month_number(d) - self.first, 0)
+        while len(self.rates) <= k:
+            self.rates.append(self.rates[-1])
+        self.rates[k] = rate
+        del self.rates[k + 1:]
+        del self.index[k + 1:]
+
+    def rate(self, k):
+        if k < len(self.rates):
+            return self.rates[k]
+        return self.rates[-1]
+
+    def _index(self, month_no):
+        k = max(month_no - self.first, 0)
+        while len(self.index) <= k:
+            i = len(self.index) - 1
+            self.index.append(self.index[i] * Fraction(100 + self.rate(i), 100))
+        return self.index[k]
+
+    def prune(self, month_no):
+        # Forget the months before month_no. growth() only takes ratios of
+        # the index, so it restarts at 1 there and values stay exact while
+        # the fractions stay as short as the oldest instrument.
+        k = month_no - self.first
+        if k <= 0:
+            return
+        self.rates = self.rates[k:] or [self.rates[-1]]
+        self.index = [Fraction(1)]
+        self.first = month_no
+
+    def growth(self, first_month, last_month):
+        if last_month < first_month:
+            return Fraction(1)
+        return self._index(last_month + 1) / self._index(first_month)
+
+
+class Instrument(object):
+    __slots__ = ('principal', 'start', 'maturity', 'day', 'amount')
+
+    def __init__(self, principal, start, maturity):
+        self.principal = principal
+        self.start = start
+        self.maturity = maturity
+        self.day = maturity.day
+        self.amount = principal
+
+    def accrual_months(self, d):
+        first = month_number(self.start)
+        if accrual_date(first, self.day) <= self.start:
+            first += 1
+        last = month_number(d)
+        if accrual_date(last, self.day) > d:
+            last -= 1
+        return first, last
+
+    def value(self, d, history):
+        first, last = self.accrual_months(min(d, self.maturity))
+        return int(self.principal * history.growth(first, last))
@@ -0,0 +1,197 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import time
+
+import numpy as np
+
+from constants import *
+from prices import DEFAULT_MODEL, MODELS, PRICE_PATH_MONTHS, get_model
+
+
+class UserBatch(object):
+    # Struct-of-arrays version of models.User: one slot per session.
+    # Every session holds at most one deposit and one loan at a time,
+    # *_term is the number of months left until it is paid out.
+
+    def __init__(self, size, seed=None, price_model=None):
+        self.size = size
+        # Independent generators per subsystem, as in rng.RandomRegistry
+        user, bank, exchange = np.random.SeedSequence(seed).spawn(3)
+        self.rng = np.random.default_rng(user)
+        self.bank_rng = np.random.default_rng(bank)
+        self.exchange_rng = np.random.default_rng(exchange)
+        self.income_tax = INITIAL_INCOME_TAX
+        self.month = 0
+
+        self.total_money = self.rng.integers(*USER_MONEY_RANGE, size=size).astype(np.float64)
+        self.profit = np.zeros(size)
+        self.deposits = np.full(size, 10000.0)
+        self.deposit_term = np.ones(size, dtype=np.int32)
+        self.loans = np.zeros(size)
+        self.loan_term = np.zeros(size, dtype=np.int32)
+        self.oil = np.zeros(size, dtype=np.int64)
+        self.land = np.zeros(size, dtype=np.int64)
+
+        self.loan_rate = np.full(size, INITIAL_LOAN_RATE, dtype=np.float64)
+        self.deposit_rate = np.full(size, INITIAL_DEPOSIT_RATE, dtype=np.float64)
+        self.price_model = get_model(price_model)
+        # Price paths of every session, PRICE_PATH_MONTHS months at a time
+        self.oil_paths = self.land_paths = None
+        self.oil_regime = self.land_regime = None
+        self.path_month = PRICE_PATH_MONTHS
+        self.oil_price = np.zeros(size)
+        self.land_price = np.zeros(size)
+        self.update_prices()
+
+    def update_rates(self):
+        # Same bounds as random.randint: both ends included
+        low, high = BANK_RATE_RANGE
+        rates = self.bank_rng.integers(low, high + 1, size=(2, self.size)).astype(np.float64)
+        self.loan_rate, self.deposit_rate = rates
+
+    def generate_prices(self):
+        # Continue every path from its last price and regime
+        oil = None if self.oil_paths is None else self.oil_paths[:, -1]
+        land = None if self.land_paths is None else self.land_paths[:, -1]
+        self.oil_paths, self.oil_regime = self.price_model.paths(
+            self.exchange_rng, self.size, PRICE_PATH_MONTHS, *OIL_PRICE_RANGE, price=oil, regime=self.oil_regime
+        )
+        self.land_paths, self.land_regime = self.price_model.paths(
+            self.exchange_rng, self.size, PRICE_PATH_MONTHS, *LAND_PRICE_RANGE, price=land, regime=self.land_regime
+        )
+        self.path_month = 0
+
+    def update_prices(self):
+        if self.path_month == PRICE_PATH_MONTHS:
+            self.generate_prices()
+        self.oil_price = self.oil_paths[:, self.path_month].astype(np.float64)
+        self.land_price = self.land_paths[:, self.path_month].astype(np.float64)
+        self.path_month += 1
+
+    def pay_income_tax(self):
+        amount = np.where(self.profit > 0, self.profit * self.income_tax // 100, 0)
+        self.total_money -= amount
+        self.profit = -amount
+
+    def update_deposits(self):
+        active = self.deposit_term > 0
+        self.deposits += np.where(active, self.deposits * self.deposit_rate / 100, 0)
+        self.deposit_term -= active
+        due = active & (self.deposit_term == 0)
+        payment = np.where(due, self.deposits, 0)
+        self.total_money += payment
+        self.profit += payment
+        self.deposits[due] = 0
+
+    def update_loans(self):
+        active = self.loan_term > 0
+        self.loans += np.where(active, self.loans * self.loan_rate / 100, 0)
+        self.loan_term -= active
+        due = active & (self.loan_term == 0)
+        payment = np.where(due, self.loans, 0)
+        self.total_money -= payment
+        self.profit -= payment
+        self.loans[due] = 0
+
+    def tick(self):
+        # Month boundary in the same order as Simulation: tax, bank, exchange,
+        # then one accrual and payout step for the outstanding instruments
+        self.month += 1
+        self.pay_income_tax()
+        self.update_rates()
+        self.update_prices()
+        self.update_deposits()
+        self.update_loans()
+
+    def run(self, months, policy=None):
+        for _ in range(months):
+            if policy is not None:
+                policy(self)
+            self.tick()
+
+    def new_deposit(self, amount, term):
+        amount = np.broadcast_to(amount, (self.size,))
+        ok = (amount < self.total_money) & (self.deposit_term == 0) & (amount > 0)
+        self.deposits[ok] = amount[ok]
+        self.deposit_term[ok] = np.broadcast_to(term, (self.size,))[ok]
+        self.total_money -= np.where(ok, amount, 0)
+        self.profit -= np.where(ok, amount, 0)
+        return ok
+
+    def new_loan(self, amount, term):
+        amount = np.broadcast_to(amount, (self.size,))
+        ok = (amount < self.total_money) & (self.loan_term == 0) & (amount > 0)
+        self.loans[ok] = amount[ok]
+        self.loan_term[ok] = np.broadcast_to(term, (self.size,))[ok]
+        self.total_money += np.where(ok, amount, 0)
+        self.profit += np.where(ok, amount, 0)
+        return ok
+
+    def _buy(self, holdings, amount, price):
+        total_price = amount * price
+        ok = (total_price < self.total_money) & (amount > 0)
+        total_price = np.where(ok, total_price, 0)
+        self.total_money -= total_price
+        self.profit -= total_price
+        holdings += np.where(ok, amount, 0)
+        return ok
+
+    def _sell(self, holdings, amount, price):
+        ok = (holdings >= amount) & (amount > 0)
+        total_money = np.where(ok, amount * price, 0)
+        self.total_money += total_money
+        self.profit += total_money
+        holdings -= np.where(ok, amount, 0)
+        return ok
+
+    def buy_oil(self, amount):
+        return self._buy(self.oil, np.broadcast_to(amount, (self.size,)), self.oil_price)
+
+    def sell_oil(self, amount):
+        return self._sell(self.oil, np.broadcast_to(amount, (self.size,)), self.oil_price)
+
+    def buy_land(self, amount):
+        return self._buy(self.land, np.broadcast_to(amount, (self.size,)), self.land_price)
+
+    def sell_land(self, amount):
+        return self._sell(self.land, np.broadcast_to(amount, (self.size,)), self.land_price)
+
+    def net_worth(self):
+        return (
+            self.total_money + self.deposits - self.loans
+            + self.oil * self.oil_price + self.land * self.land_price
+        )
+
+    def summary(self):
+        worth = self.net_worth()
+        return {
+            'sessions': self.size,
+            'months': self.month,
+            'mean': float(worth.mean()),
+            'std': float(worth.std()),
+            'min': float(worth.min()),
+            'p50': float(np.median(worth)),
+            'max': float(worth.max()),
+        }
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Monte Carlo run of many Commersant sessions')
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--months', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--prices', choices=sorted(MODELS), default=DEFAULT_MODEL, help='Price model')
+    args = parser.parse_args()
+
+    batch = UserBatch(args.sessions, seed=args.seed, price_model=args.prices)
+    started = time.perf_counter()
+    batch.run(args.months)
+    elapsed = time.perf_counter() - started
+    for key, value in batch.summary().items():
+        print('%s: %s' % (key, value))
+    print('%.0f сессия-месяцев/с' % (args.sessions * args.months / elapsed))
+
+
+if __name__ == '__main__':
+    _main()
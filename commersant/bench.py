@@ -0,0 +1,227 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+from datetime import timedelta
+
+import numpy as np
+
+from constants import *
+from models import CAR_CATALOG, Bank, Market, User
+from orderbook import BUY, SELL, OrderBook
+from prices import MODELS, PRICE_PATH_MONTHS, PricePath, get_model
+from rng import RandomRegistry
+from simulation import Simulation
+from terminal import VirtualBackend, console
+from utils import add_months
+
+
+LEDGER_SIZES = (10, 100, 10000)
+# Resting orders in the order book benchmark
+BOOK_SIZE = 20000
+# Price paths generated at once, and their length in months
+PATH_COUNT = 100000
+PATH_MONTHS = 120
+# Objects built to average the memory footprint
+FOOTPRINT_COUNT = 200
+
+
+def measure(func, min_time=0.2):
+    # Repeat until the run is long enough to trust the clock
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / loops
+        loops *= 2
+
+
+def result(name, seconds, **params):
+    return {
+        'name': name,
+        'params': params,
+        'seconds_per_op': seconds,
+        'ops_per_second': 1 / seconds if seconds else None,
+    }
+
+
+def bench_user_update(size):
+    simulation = Simulation(seed=size)
+    user = simulation.user
+    stream = simulation.random.stream('bench')
+    start = simulation.date
+    for _ in range(size):
+        # Spread the days of month, keep everything alive for a year
+        day = start + timedelta(days=stream.randrange(28))
+        maturity = add_months(day, 12 + stream.randrange(12))
+        user.deposits.add(start, maturity, stream.randrange(1000, 5000))
+        user.loans.add(start, maturity, stream.randrange(1000, 5000))
+    days = [start + timedelta(days=i) for i in range(1, 31)]
+
+    def month():
+        for d in days:
+            user.update(d)
+
+    return result('user.update', measure(month) / len(days), instruments=size * 2)
+
+
+def bench_market():
+    market = Simulation(seed=1).market
+    return [
+        result('market.update_cars', measure(market.update_cars)),
+        result('market.update_apartments', measure(market.update_apartments)),
+    ]
+
+
+def bench_exchange():
+    exchange = Simulation(seed=1).exchange
+    months = iter(range(1, 10 ** 9))
+
+    def update():
+        # A new month every time, so the price history keeps wrapping
+        exchange.update_prices(add_months(DATE, next(months)))
+
+    return result('exchange.update_prices', measure(update))
+
+
+def bench_order_book(size=BOOK_SIZE):
+    # Bids below 1000, asks from 1000 up, one owner per order
+    stream = RandomRegistry(1).stream('bench')
+    book = OrderBook()
+    for _ in range(size // 2):
+        book.rest(book.order(object(), BUY, stream.randrange(500, 1000), stream.randrange(1, 50)))
+        book.rest(book.order(object(), SELL, stream.randrange(1000, 1500), stream.randrange(1, 50)))
+    settle = lambda buy, sell, price, amount: None
+
+    def trade():
+        # Take the best ask and put a fresh one back, the book keeps its size
+        ask = book.best(SELL)
+        book.match(book.order(None, BUY, ask.price, ask.remaining), settle)
+        book.rest(book.order(object(), SELL, stream.randrange(1000, 1500), stream.randrange(1, 50)))
+
+    def cancel():
+        order = book.order(object(), BUY, stream.randrange(500, 1000), 1)
+        book.rest(order)
+        book.cancel(order.id)
+
+    return [
+        result('orderbook.match', measure(trade), resting=len(book)),
+        result('orderbook.rest+cancel', measure(cancel), resting=len(book)),
+    ]
+
+
+def bench_price_models():
+    results = []
+    stream = RandomRegistry(1).stream('bench')
+    rng = np.random.default_rng(1)
+    for name in sorted(MODELS):
+        model = get_model(name)
+        low, high = OIL_PRICE_RANGE
+        path = PricePath(model, CAR_CATALOG.price_ranges, stream)
+        results.append(result(
+            'prices.path', measure(path.generate), model=name, goods=len(path), months=PRICE_PATH_MONTHS,
+        ))
+        seconds = measure(lambda: model.paths(rng, PATH_COUNT, PATH_MONTHS, low, high))
+        results.append(result('prices.paths', seconds, model=name, paths=PATH_COUNT, months=PATH_MONTHS))
+        results[-1]['paths_per_second'] = PATH_COUNT / seconds
+    return results
+
+
+def footprint(name, factory):
+    # Bytes allocated per object, everything it references included
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory(i) for i in range(FOOTPRINT_COUNT)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return {'name': name, 'params': {'objects': len(objects)}, 'bytes_per_object': size / len(objects)}
+
+
+def bench_footprint():
+    stream = RandomRegistry(1).stream('bench')
+    return [
+        footprint('footprint.simulation', lambda i: Simulation(seed=i)),
+        footprint('footprint.user', lambda i: User('Bench', RandomRegistry(i))),
+        footprint('footprint.bank', lambda i: Bank(stream)),
+        footprint('footprint.market', lambda i: Market(stream)),
+    ]
+
+
+def bench_frame():
+    from main import Screen
+    backend = VirtualBackend(40, 120)
+    console.use(backend)
+    simulation = Simulation('Bench', seed=1)
+    screen = Screen(backend.stdscr, simulation)
+    simulation.register(screen.date)
+
+    def tick():
+        simulation.tick()
+        screen.update_panels()
+
+    results = [result('screen.update_panels', measure(screen.update_panels))]
+    backend.frames.clear()
+    results.append(result('simulation.tick+frame', measure(tick)))
+    frames = len(backend.frames)
+    results.append({
+        'name': 'frame.output',
+        'params': {'frames': frames},
+        'writes_per_frame': sum(f['writes'] for f in backend.frames) / frames,
+        'bytes_per_frame': sum(f['bytes'] for f in backend.frames) / frames,
+    })
+    return results
+
+
+def bench_startup():
+    # New session up to its first frame, paid by the server on every connect
+    from main import Screen
+    backend = VirtualBackend(40, 120)
+    console.use(backend)
+
+    def start():
+        Screen(backend.stdscr, Simulation('Bench', seed=1))
+
+    return result('screen.startup', measure(start))
+
+
+def run():
+    results = []
+    for size in LEDGER_SIZES:
+        results.append(bench_user_update(size))
+    results.extend(bench_market())
+    results.append(bench_exchange())
+    results.extend(bench_order_book())
+    results.extend(bench_price_models())
+    results.extend(bench_frame())
+    results.append(bench_startup())
+    results.extend(bench_footprint())
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the Commersant hot paths')
+    parser.add_argument('--output', default=None, help='JSON file, stdout by default')
+    args = parser.parse_args()
+
+    report = json.dumps(run(), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    _main()
@@ -1,3 +1,4 @@
+from .catalog import *
 from .colors import *
 from .initials import *
 from .keys import *
@@ -0,0 +1,21 @@
+# -*- encoding: utf8 -*-
+
+# Goods sold on the market and their price ranges
+CARS = (
+    ('Луаз-969', (6500, 12000)),
+    ('Москвич-412', (10000, 20000)),
+    ('Москвич-2141', (18000, 27000)),
+    ('ВАЗ-2106', (24000, 37000)),
+    ('ВАЗ-2109', (33000, 50000)),
+    ('ГАЗ-24', (45000, 65000)),
+    ('ГАЗ-3102', (60000, 75000)),
+)
+APARTMENTS = (
+    ('1-комн', (6500, 12000)),
+    ('2-комн', (9000, 17000)),
+    ('3-комн', (16000, 30000)),
+    ('4-комн', (20000, 35000)),
+    ('5-комн', (27000, 50000)),
+    ('6-комн', (35000, 65000)),
+    ('7-комн', (40000, 75000)),
+)
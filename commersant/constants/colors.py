@@ -1,8 +1,5 @@
 # -*- encoding: utf8 -*-
 
-import curses
-
-
 # Constants format: FOREGROUND_BACKGROUND
 BLACK_BLUE = 1
 BLACK_WHITE = 2
@@ -14,12 +11,16 @@ YELLOW_BLUE = 7
 BLACK_CYAN = 8
 
 
-def init_colors():
-    curses.init_pair(BLACK_BLUE, curses.COLOR_BLACK, curses.COLOR_BLUE)
-    curses.init_pair(BLACK_WHITE, curses.COLOR_BLACK, curses.COLOR_WHITE)
-    curses.init_pair(RED_WHITE, curses.COLOR_RED, curses.COLOR_WHITE)
-    curses.init_pair(WHITE_BLUE, curses.COLOR_WHITE, curses.COLOR_BLUE)
-    curses.init_pair(CYAN_BLUE, curses.COLOR_CYAN, curses.COLOR_BLUE)
-    curses.init_pair(MAGENTA_BLUE, curses.COLOR_MAGENTA, curses.COLOR_BLUE)
-    curses.init_pair(YELLOW_BLUE, curses.COLOR_YELLOW, curses.COLOR_BLUE)
-    curses.init_pair(BLACK_CYAN, curses.COLOR_BLACK, curses.COLOR_CYAN)
+def init_colors(init_pair=None):
+    import curses
+
+    if init_pair is None:
+        init_pair = curses.init_pair
+    init_pair(BLACK_BLUE, curses.COLOR_BLACK, curses.COLOR_BLUE)
+    init_pair(BLACK_WHITE, curses.COLOR_BLACK, curses.COLOR_WHITE)
+    init_pair(RED_WHITE, curses.COLOR_RED, curses.COLOR_WHITE)
+    init_pair(WHITE_BLUE, curses.COLOR_WHITE, curses.COLOR_BLUE)
+    init_pair(CYAN_BLUE, curses.COLOR_CYAN, curses.COLOR_BLUE)
+    init_pair(MAGENTA_BLUE, curses.COLOR_MAGENTA, curses.COLOR_BLUE)
+    init_pair(YELLOW_BLUE, curses.COLOR_YELLOW, curses.COLOR_BLUE)
+    init_pair(BLACK_CYAN, curses.COLOR_BLACK, curses.COLOR_CYAN)
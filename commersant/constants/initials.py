@@ -6,6 +6,8 @@ from datetime import date, timedelta
 # Time
 DATE = date(2017, 1, 1)
 TIMEDELTA = timedelta(days=1)
+# Seconds of real time per game day
+TICK = 1
 
 # Rates
 INITIAL_DEPOSIT_RATE = 8
@@ -2,9 +2,14 @@
 
 KEY_ENTER = 10
 KEY_ESC = 27
+KEY_PLUS = 43
+KEY_MINUS = 45
 KEY_0 = 48
 KEY_1 = 49
 KEY_A = 97
+KEY_C = 99
 KEY_D = 100
 KEY_N = 110
+KEY_P = 112
 KEY_Z = 122
+KEY_DEL = 127
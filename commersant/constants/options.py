@@ -4,11 +4,22 @@ from collections import OrderedDict
 YES = 1
 NO = 0
 
+# Saved game
+SAVE_PATH = 'commersant.sav'
+JOURNAL_PATH = 'commersant.journal'
+
+# Seconds between dumps of the timing histograms
+PROFILE_DUMP_INTERVAL = 10
+
+# Years of oil and land prices kept by the stock exchange
+PRICE_HISTORY_YEARS = 5
+
 MENU_OPTIONS = OrderedDict([
     ('F1', 'Банк'),
     ('F2', 'Рынок'),
     ('F3', 'Биржа'),
     ('F4', 'Хозяйство'),
     ('F9', 'Секретарь'),
+    ('+/-', 'Скорость'),
     ('ESC', 'Выход'),
 ])
@@ -8,3 +8,6 @@ OIL_PRICE_RANGE = (15, 40)
 # Amount of oil needed for heating
 HEAT_RANGE = (2, 16)
 USER_MONEY_RANGE = (30000, 60000)
+
+# Allowed seconds per game day
+TICK_RANGE = (0.05, 8)
@@ -0,0 +1,79 @@
+# -*- encoding: utf8 -*-
+
+import curses
+
+from constants import *
+from dispatch import KeyHandler
+from terminal import console
+
+
+# Longest answer a prompt takes
+PROMPT_LENGTH = 10
+
+
+class Prompt(KeyHandler):
+    # A line of input typed into a window one key at a time, in place of
+    # echo() and getstr(). done(text) gets the text on Enter, '' on Esc.
+    bindings = {
+        KEY_ENTER: 'submit',
+        curses.KEY_ENTER: 'submit',
+        KEY_ESC: 'cancel',
+        KEY_DEL: 'erase',
+        curses.KEY_BACKSPACE: 'erase',
+    }
+
+    def __init__(self, window, y, x, done, attr=0, length=PROMPT_LENGTH):
+        self.window = window
+        self.y = y
+        self.x = x
+        self.done = done
+        self.attr = attr
+        self.length = length
+        self.text = ''
+
+    def default_key(self, key):
+        if 32 <= key < 127 and len(self.text) < self.length:
+            self.window.addstr(self.y, self.x + len(self.text), chr(key), self.attr)
+            self.window.noutrefresh()
+            self.text += chr(key)
+
+    def erase(self):
+        if self.text:
+            self.text = self.text[:-1]
+            self.window.addstr(self.y, self.x + len(self.text), ' ', self.attr)
+            self.window.noutrefresh()
+
+    def finish(self, text):
+        self.dispatcher.pop(self)
+        self.done(text)
+
+    def submit(self):
+        self.finish(self.text)
+
+    def cancel(self):
+        self.finish('')
+
+
+class Dialog(KeyHandler):
+    # Boxed message in the middle of a window. Any key closes it,
+    # done(key) gets the key, e.g. to answer a question.
+
+    def __init__(self, window, title, lines, done=None, attr=0):
+        self.done = done
+        height = len(lines) + 4
+        width = max(len(line) for line in (title,) + tuple(lines)) + 7
+        parent_height, parent_width = window.getmaxyx()
+        self.window = window.derwin(
+            height, width, parent_height // 2 - height // 2, parent_width // 2 - width // 2
+        )
+        self.window.erase()
+        self.window.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.window.addstr(0, width // 2 - len(title) // 2, title, attr)
+        for y, line in enumerate(lines, 2):
+            self.window.addstr(y, width // 2 - len(line) // 2, line, attr)
+        self.window.noutrefresh()
+
+    def default_key(self, key):
+        self.dispatcher.pop(self)
+        if self.done is not None:
+            self.done(key)
@@ -0,0 +1,67 @@
+# -*- encoding: utf8 -*-
+
+from collections import deque
+
+
+# Keys waiting for dispatch; in a key storm the keys past it are
+# dropped, so the ones typed first still do what they meant
+KEY_QUEUE_SIZE = 256
+
+
+class KeyHandler(object):
+    # Keys are looked up in a class level table of key -> method name,
+    # anything else goes to default_key. Handlers return what the method
+    # returns, so widgets can report a choice to their owner.
+    bindings = {}
+    dispatcher = None
+
+    def handle_key(self, key):
+        name = self.bindings.get(key)
+        if name is None:
+            return self.default_key(key)
+        return getattr(self, name)()
+
+    def default_key(self, key):
+        return None
+
+
+class Dispatcher(object):
+    # Central input queue. Keys go to the handler on top of a stack: the
+    # game at the bottom, then an open panel, then its menus, prompts and
+    # dialogs. Handlers open and close each other through push and pop,
+    # so nothing waits for a key and nothing recurses.
+
+    def __init__(self, root):
+        self.stack = [root]
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.stack)
+
+    @property
+    def top(self):
+        return self.stack[-1]
+
+    def push(self, handler):
+        handler.dispatcher = self
+        self.stack.append(handler)
+        return handler
+
+    def pop(self, handler):
+        # The handler and whatever it opened on top of itself
+        if handler in self.stack[1:]:
+            del self.stack[self.stack.index(handler):]
+
+    def feed(self, key):
+        # False if the key was dropped
+        if len(self.queue) >= KEY_QUEUE_SIZE:
+            return False
+        self.queue.append(key)
+        return True
+
+    def dispatch(self):
+        # Handle the oldest queued key, False if there was none
+        if not self.queue:
+            return False
+        self.top.handle_key(self.queue.popleft())
+        return True
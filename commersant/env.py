@@ -0,0 +1,202 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import itertools
+import time
+
+from datetime import timedelta
+
+import numpy as np
+
+from constants import *
+from models import APARTMENT_CATALOG, CAR_CATALOG
+from orderbook import BUY, SELL
+from prices import DEFAULT_MODEL, MODELS
+from simulation import Simulation
+
+
+# Actions are (code, argument, amount) tuples of ints:
+# deposits and loans take the term in months as argument, cars and
+# apartments their catalog id; oil and land are market orders of amount.
+NOOP = 0
+DEPOSIT = 1
+LOAN = 2
+BUY_OIL = 3
+SELL_OIL = 4
+BUY_LAND = 5
+SELL_LAND = 6
+BUY_CAR = 7
+BUY_APARTMENT = 8
+SELL_CAR = 9
+SELL_APARTMENT = 10
+ACTIONS = (
+    'noop', 'deposit', 'loan', 'buy_oil', 'sell_oil', 'buy_land', 'sell_land',
+    'buy_car', 'buy_apartment', 'sell_car', 'sell_apartment',
+)
+
+# What each position of an observation holds
+OBSERVATION = (
+    ('money', 'profit', 'deposits', 'loans', 'oil', 'land', 'car', 'apartment')
+    + ('loan_rate', 'deposit_rate', 'income_tax', 'heat', 'oil_price', 'land_price')
+    + tuple('car_price.%d' % i for i in range(len(CAR_CATALOG)))
+    + tuple('apartment_price.%d' % i for i in range(len(APARTMENT_CATALOG)))
+    + ('day', 'month')
+)
+
+EPISODE_DAYS = 365
+
+
+class Env(object):
+    # One game driven by a bot: reset(seed) starts it, every step applies
+    # an action and plays days_per_step days. The reward is the change of
+    # the player's net worth, the game is done after `days` days or once
+    # the player's money goes negative.
+
+    def __init__(self, days=EPISODE_DAYS, days_per_step=1, price_model=None):
+        self.days = days
+        self.days_per_step = days_per_step
+        self.price_model = price_model
+        self.simulation = None
+        self.end = None
+        self.worth = 0
+
+    def reset(self, seed=None):
+        self.simulation = Simulation('Bot', seed=seed, price_model=self.price_model)
+        self.end = self.simulation.date + timedelta(days=self.days)
+        self.worth = self.net_worth()
+        return self.observe()
+
+    def net_worth(self):
+        simulation = self.simulation
+        user = simulation.user
+        exchange = simulation.exchange
+        market = simulation.market
+        return (
+            user.total_money + user.get_deposits() - user.get_loans()
+            + user.property.oil * exchange.oil_price + user.property.land * exchange.land_price
+            + market.price(user.property.car) + market.price(user.property.apt)
+        )
+
+    def observe(self):
+        simulation = self.simulation
+        user = simulation.user
+        bank = simulation.bank
+        exchange = simulation.exchange
+        market = simulation.market
+        observation = [
+            user.total_money, user.profit, user.get_deposits(), user.get_loans(),
+            user.property.oil, user.property.land,
+            CAR_CATALOG.index.get(user.property.car, -1),
+            APARTMENT_CATALOG.index.get(user.property.apt, -1),
+            bank.loan_rate, bank.deposit_rate, simulation.tax.income_tax, simulation.secretary.heat,
+            exchange.oil_price, exchange.land_price,
+        ]
+        observation.extend(market.car_prices)
+        observation.extend(market.apt_prices)
+        observation.append(simulation.date.day)
+        observation.append(simulation.date.month)
+        return [float(value) for value in observation]
+
+    def act(self, action):
+        # Apply an action, True if it went through
+        code, argument, amount = (int(value) for value in action)
+        simulation = self.simulation
+        user = simulation.user
+        market = simulation.market
+        if code in (DEPOSIT, LOAN, BUY_OIL, SELL_OIL, BUY_LAND, SELL_LAND) and amount <= 0:
+            return False
+        if code == DEPOSIT:
+            return argument > 0 and user.new_deposit(amount, argument)
+        if code == LOAN:
+            return argument > 0 and user.new_loan(amount, argument)
+        if code in (BUY_OIL, SELL_OIL, BUY_LAND, SELL_LAND):
+            good = simulation.exchange.OIL if code in (BUY_OIL, SELL_OIL) else simulation.exchange.LAND
+            side = BUY if code in (BUY_OIL, BUY_LAND) else SELL
+            order, fills = simulation.place_order(good, side, amount)
+            return bool(fills)
+        if code == BUY_CAR and 0 <= argument < len(market.cars):
+            car = market.cars.names[argument]
+            return user.buy_car(car, market.car_price(car))
+        if code == BUY_APARTMENT and 0 <= argument < len(market.apartments):
+            apt = market.apartments.names[argument]
+            return user.buy_apartment(apt, market.apt_price(apt))
+        if code == SELL_CAR and user.property.car in market.cars:
+            user.sell_car(market.price(user.property.car))
+            return True
+        if code == SELL_APARTMENT and user.property.apt in market.apartments:
+            user.sell_apt(market.price(user.property.apt))
+            return True
+        return False
+
+    def step(self, action=None):
+        if action is not None:
+            self.act(action)
+        simulation = self.simulation
+        for _ in range(self.days_per_step):
+            simulation.tick()
+            if simulation.date >= self.end:
+                break
+        worth = self.net_worth()
+        reward, self.worth = worth - self.worth, worth
+        done = simulation.date >= self.end or simulation.user.total_money < 0
+        return self.observe(), reward, done
+
+
+class VecEnv(object):
+    # Many games stepped together, observations as a (count, features)
+    # numpy array. A finished game starts over at once with the next seed,
+    # its row then holds the first observation of the new game.
+
+    def __init__(self, count, **kwargs):
+        self.envs = [Env(**kwargs) for _ in range(count)]
+        self.seeds = None
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self, seed=None):
+        self.seeds = None if seed is None else itertools.count(seed)
+        return np.array([env.reset(self._seed()) for env in self.envs])
+
+    def _seed(self):
+        return None if self.seeds is None else next(self.seeds)
+
+    def step(self, actions):
+        observations = []
+        rewards = np.empty(len(self.envs))
+        dones = np.zeros(len(self.envs), dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[i], dones[i] = env.step(action)
+            if dones[i]:
+                observation = env.reset(self._seed())
+            observations.append(observation)
+        return np.array(observations), rewards, dones
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Random bots against the game, for throughput')
+    parser.add_argument('--envs', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--prices', choices=sorted(MODELS), default=DEFAULT_MODEL, help='Price model')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    envs = VecEnv(args.envs, price_model=args.prices)
+    envs.reset(args.seed)
+    total = 0.0
+    started = time.perf_counter()
+    for _ in range(args.steps):
+        codes = rng.integers(0, len(ACTIONS), size=args.envs)
+        arguments = rng.integers(1, 12, size=args.envs)
+        amounts = rng.integers(1, 1000, size=args.envs)
+        observations, rewards, dones = envs.step(list(zip(codes, arguments, amounts)))
+        total += rewards.sum()
+    elapsed = time.perf_counter() - started
+    steps = args.envs * args.steps
+    print('%s шагов за %.3f с, %.0f шагов/с' % (steps, elapsed, steps / elapsed))
+    print('Средняя награда: %.1f' % (total / args.envs))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,112 @@
+# -*- encoding: utf8 -*-
+
+from array import array
+
+from accrual import month_number
+from constants import *
+
+
+# Marks a month without a price, real prices are never zero
+MISSING = 0
+
+
+class PriceSeries(object):
+    # Monthly prices of one commodity in a ring buffer of whole years.
+    # A month is kept in slot month_number % capacity, so a calendar year
+    # always takes one block and the oldest year is dropped as a whole.
+    # Every year keeps a running min, max and sum, so its summary is O(1).
+    __slots__ = ('years', 'values', 'first', 'last', 'year_ids', 'mins', 'maxs', 'sums', 'counts')
+
+    def __init__(self, years=PRICE_HISTORY_YEARS):
+        self.years = years
+        self.values = array('I', [MISSING] * (years * 12))
+        # Month numbers of the oldest and the newest stored month
+        self.first = None
+        self.last = None
+        self.year_ids = array('i', [-1] * years)
+        self.mins = array('I', [0] * years)
+        self.maxs = array('I', [0] * years)
+        self.sums = array('Q', [0] * years)
+        self.counts = array('B', [0] * years)
+
+    def __len__(self):
+        return 0 if self.last is None else self.last - self.first + 1
+
+    def append(self, month_no, value):
+        if self.last is not None and month_no <= self.last:
+            if month_no < self.last:
+                raise ValueError('Prices are appended in order')
+            # Same month again: replace the price and recount its year
+            self.values[month_no % len(self.values)] = value
+            self._recount(month_no // 12)
+            return
+        if self.last is None:
+            self.first = month_no
+        else:
+            # Skipped months have no price
+            for m in range(max(self.last + 1, month_no - len(self.values) + 1), month_no):
+                self.values[m % len(self.values)] = MISSING
+        self.last = month_no
+        self.values[month_no % len(self.values)] = value
+
+        year = month_no // 12
+        slot = year % self.years
+        if self.year_ids[slot] != year:
+            # A new year takes the place of the oldest one
+            self.first = max(self.first, (year - self.years + 1) * 12)
+            self.year_ids[slot] = year
+            self.mins[slot] = self.maxs[slot] = self.sums[slot] = value
+            self.counts[slot] = 1
+        else:
+            self.mins[slot] = min(self.mins[slot], value)
+            self.maxs[slot] = max(self.maxs[slot], value)
+            self.sums[slot] += value
+            self.counts[slot] += 1
+
+    def _recount(self, year):
+        slot = year % self.years
+        values = [v for v in self.months(year * 12, year * 12 + 11) if v is not None]
+        self.mins[slot] = min(values)
+        self.maxs[slot] = max(values)
+        self.sums[slot] = sum(values)
+        self.counts[slot] = len(values)
+
+    def get(self, month_no):
+        if self.last is None or not self.first <= month_no <= self.last:
+            return None
+        value = self.values[month_no % len(self.values)]
+        return value if value != MISSING else None
+
+    def months(self, first, last):
+        return [self.get(m) for m in range(first, last + 1)]
+
+    def year(self, year):
+        return self.months(year * 12, year * 12 + 11)
+
+    def summary(self, year):
+        # (min, max, average) of a calendar year, None if nothing is stored
+        slot = year % self.years
+        if self.last is None or self.year_ids[slot] != year or year < self.first // 12:
+            return None
+        return self.mins[slot], self.maxs[slot], self.sums[slot] / self.counts[slot]
+
+class PriceHistory(object):
+    # Oil and land prices of a stock exchange
+
+    __slots__ = ('oil', 'land')
+
+    def __init__(self, years=PRICE_HISTORY_YEARS):
+        self.oil = PriceSeries(years)
+        self.land = PriceSeries(years)
+
+    def append(self, date, oil, land):
+        month_no = month_number(date)
+        self.oil.append(month_no, oil)
+        self.land.append(month_no, land)
+
+    def year(self, year):
+        # Chart row: (oil, land) per month of the year, None where unknown
+        return [
+            (oil, land) if oil is not None else None
+            for oil, land in zip(self.oil.year(year), self.land.year(year))
+        ]
@@ -0,0 +1,123 @@
+# -*- encoding: utf8 -*-
+
+import calendar
+import heapq
+
+from accrual import Instrument, from_cents, month_number, to_cents
+
+
+class Ledger(object):
+    # Deposits or loans keyed by maturity date. Instruments are also indexed
+    # by their accrual day of month and kept in a min-heap of maturities, so
+    # a daily tick only touches the instruments that are due on that day.
+    # Amounts are evaluated in closed form from the bank's rate history.
+    # The grand total and the per-month totals are kept up to date on every
+    # change, so reading them costs nothing. Start months are counted and
+    # kept in a min-heap the same way, for pruning the rate history.
+    __slots__ = ('history', 'instruments', 'by_day', 'maturities', 'total', 'by_month', 'starts', 'start_months')
+
+    def __init__(self, history, items=None, start=None):
+        self.history = history
+        self.instruments = {}
+        self.by_day = {}
+        self.maturities = []
+        self.total = 0
+        self.by_month = [0] * 12
+        self.starts = {}
+        self.start_months = []
+        if items:
+            for date, amount in items.items():
+                self.add(start, date, amount)
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __iter__(self):
+        return iter(self.instruments)
+
+    def __contains__(self, date):
+        return date in self.instruments
+
+    def __getitem__(self, date):
+        return from_cents(sum(i.amount for i in self.instruments[date]))
+
+    def items(self):
+        return ((date, self[date]) for date in self.instruments)
+
+    def values(self):
+        return (self[date] for date in self.instruments)
+
+    def total_amount(self):
+        return from_cents(self.total)
+
+    def month_amount(self, month):
+        return from_cents(self.by_month[month - 1])
+
+    def _change(self, date, cents):
+        self.total += cents
+        self.by_month[date.month - 1] += cents
+
+    def add(self, start, date, amount):
+        self.insert(Instrument(to_cents(amount), start, date))
+
+    def insert(self, instrument):
+        date = instrument.maturity
+        self._change(date, instrument.amount)
+        start = month_number(instrument.start)
+        if start not in self.starts:
+            self.starts[start] = 0
+            heapq.heappush(self.start_months, start)
+        self.starts[start] += 1
+        if date in self.instruments:
+            self.instruments[date].append(instrument)
+            return
+        self.instruments[date] = [instrument]
+        self.by_day.setdefault(date.day, set()).add(date)
+        heapq.heappush(self.maturities, date)
+
+    def pop(self, date):
+        amount = self[date]
+        for instrument in self.instruments.pop(date):
+            self._change(date, -instrument.amount)
+            start = month_number(instrument.start)
+            self.starts[start] -= 1
+            if not self.starts[start]:
+                del self.starts[start]
+        bucket = self.by_day[date.day]
+        bucket.discard(date)
+        if not bucket:
+            del self.by_day[date.day]
+        # The heap entry is dropped lazily in due()
+        return amount
+
+    def accrue(self, date):
+        if not self.by_day:
+            return
+        days = [date.day]
+        last_day = calendar.monthrange(date.year, date.month)[1]
+        if date.day == last_day:
+            days.extend(range(last_day + 1, 32))
+        for day in days:
+            for maturity in self.by_day.get(day, ()):
+                for instrument in self.instruments[maturity]:
+                    amount = instrument.value(date, self.history)
+                    self._change(maturity, amount - instrument.amount)
+                    instrument.amount = amount
+
+    def prune(self, date):
+        # Rates from before every instrument started are not needed again.
+        # Months with nothing left are dropped from the heap here.
+        while self.start_months and self.start_months[0] not in self.starts:
+            heapq.heappop(self.start_months)
+        if self.start_months:
+            self.history.prune(self.start_months[0])
+        else:
+            self.history.prune(month_number(date))
+
+    def due(self, date):
+        result = []
+        while self.maturities and self.maturities[0] <= date:
+            maturity = heapq.heappop(self.maturities)
+            if maturity in self.instruments and maturity not in result:
+                result.append(maturity)
+        return result
@@ -1,295 +1,116 @@
 # -*- encoding: utf8 -*-
 
-import random
 import time
 
+# Imports of the game are timed for the startup report
+STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import curses
+import sys
+
 from abc import ABCMeta, abstractmethod
+from functools import cached_property, partial
 
 from constants import *
-from menu import Menu, MultipleMenu
-from observer import Observable, Observer
-from utils import human_money, construct_date, validate_int, validate_month
+from dialogs import Dialog, Prompt
+from dispatch import Dispatcher, KeyHandler
+from menu import ItemSource, Menu, MultipleMenu
+from observer import Observer
+from orderbook import BUY, SELL
+from simulation import Simulation
+from storage import open_game, save
+from terminal import VirtualBackend, console
+from timing import Profiler, StartupReport
+from utils import human_money, validate_int, validate_month
 
+IMPORTED = time.perf_counter()
 
-class Panel(object, metaclass=ABCMeta):
+
+class Panel(KeyHandler, metaclass=ABCMeta):
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         self.panel = None
+        # Set by Screen.open_panel for the panels that take keys
+        self.screen = None
         self.height = height
         self.width = width
         self.begin_y = begin_y
         self.begin_x = begin_x
+        # Text currently on the window by (y, x), used to skip unchanged fields
+        self.fields = {}
+        self.damaged = True
 
     @abstractmethod
     def add_content(self):
         pass
 
+    def draw_frame(self):
+        pass
+
     def create_panel(self):
         if not self.panel:
-            self.panel = curses.newwin(self.height, self.width, self.begin_y, self.begin_x)
+            self.panel = console.newwin(self.height, self.width, self.begin_y, self.begin_x)
+            self.damage()
         return self.panel
 
+    def damage(self):
+        self.damaged = True
+        self.fields = {}
+
+    def put(self, y, x, text, attr=0):
+        old = self.fields.get((y, x))
+        if old == (text, attr):
+            return
+        self.fields[(y, x)] = (text, attr)
+        if old is not None and len(old[0]) > len(text):
+            # Wipe the tail of a longer previous value
+            text = text.ljust(len(old[0]))
+        self.panel.addstr(y, x, text, attr)
+
     def show(self):
         if not self.panel:
             self.create_panel()
+        if self.damaged:
+            self.draw_frame()
+            self.damaged = False
         self.add_content()
-        self.panel.refresh()
-        return self.panel
+        # Anything staged here covers the panels stacked above this one
+        changed = self.panel.is_wintouched()
+        self.panel.noutrefresh()
+        return changed
+
+    def overlaps(self, other):
+        return (
+            self.begin_y < other.begin_y + other.height and other.begin_y < self.begin_y + self.height and
+            self.begin_x < other.begin_x + other.width and other.begin_x < self.begin_x + self.width
+        )
+
+    def touch(self):
+        if self.panel:
+            self.panel.touchwin()
 
     def hide(self):
         self.panel = None
 
+    def opened(self):
+        pass
 
-class DateCounter(Observable):
-    pass
-
-
-class Bank(Observer):
-
-    def __init__(self):
-        self.loan_rate = INITIAL_LOAN_RATE
-        self.deposit_rate = INITIAL_DEPOSIT_RATE
-
-    def update(self, date):
-        if date.day == 1:
-            self.loan_rate = random.randint(*BANK_RATE_RANGE)
-            self.deposit_rate = random.randint(*BANK_RATE_RANGE)
-
-    def update_deposits(self, deposits):
-        for month, money in deposits.items():
-            deposits[month] = money + money * self.deposit_rate / 100
-
-    def update_loans(self, loans):
-        for month, money in loans.items():
-            loans[month] = money + money * self.loan_rate / 100
-
-
-class Market(Observer):
-
-    def __init__(self):
-        self.cars = OrderedDict([
-            ('Луаз-969', {'price': 0, 'price_range': (6500, 12000)}),
-            ('Москвич-412', {'price': 0, 'price_range': (10000, 20000)}),
-            ('Москвич-2141', {'price': 0, 'price_range': (18000, 27000)}),
-            ('ВАЗ-2106', {'price': 0, 'price_range': (24000, 37000)}),
-            ('ВАЗ-2109', {'price': 0, 'price_range': (33000, 50000)}),
-            ('ГАЗ-24', {'price': 0, 'price_range': (45000, 65000)}),
-            ('ГАЗ-3102', {'price': 0, 'price_range': (60000, 75000)}),
-        ])
-        self.apartments = OrderedDict([
-            ('1-комн', {'price': 0, 'price_range': (6500, 12000)}),
-            ('2-комн', {'price': 0, 'price_range': (9000, 17000)}),
-            ('3-комн', {'price': 0, 'price_range': (16000, 30000)}),
-            ('4-комн', {'price': 0, 'price_range': (20000, 35000)}),
-            ('5-комн', {'price': 0, 'price_range': (27000, 50000)}),
-            ('6-комн', {'price': 0, 'price_range': (35000, 65000)}),
-            ('7-комн', {'price': 0, 'price_range': (40000, 75000)}),
-        ])
-        self.update_apartments()
-        self.update_cars()
-
-    def _count_max_width(self, product_dict):
-        return max(len(i) for i in product_dict)
-
-    def count_cars_width(self):
-        return self._count_max_width(self.cars)
-
-    def count_apts_width(self):
-        return self._count_max_width(self.apartments)
-
-    def update(self, date):
-        if date.day == 1:
-            self.update_cars()
-            self.update_apartments()
-
-    def update_cars(self):
-        for car in self.cars:
-            self.cars[car]['price'] = random.randrange(*self.cars[car]['price_range'])
+    def close(self):
+        self.screen.close_panel(self)
 
-    def update_apartments(self):
-        for apt in self.apartments:
-            self.apartments[apt]['price'] = random.randrange(*self.apartments[apt]['price_range'])
+    def ask(self, y, x, question, done, attr=0):
+        # The answer is typed after the question, done(text) gets it
+        self.panel.addstr(y, x, question, attr)
+        self.dispatcher.push(Prompt(self.panel, y, x + len(question), done, attr))
 
+    def alert(self, title, lines, done=None, attr=0):
+        self.dispatcher.push(Dialog(self.panel, title, lines, done, attr))
 
-class User(Observer):
-
-    def __init__(self, name):
-        self.name = name
-        self.scores = 0
-        self.total_money = random.randrange(*USER_MONEY_RANGE)
-        self.property = {
-            'apt': 'Живу у мамы',
-            'car': '-',
-            'oil': 0,
-            'land': 0,
-        }
-        self.oil_benefit = {
-            'bought': 0,
-            'sold': 0,
-            'benefit': 0
-        }
-        self.land_benefit = {
-            'bought': 0,
-            'sold': 0,
-            'benefit': 0
-        }
-        self.marriage = False
-        self.sick = False
-        self.deposits = {construct_date(day=4): 10000}
-        self.loans = {}
-        self.bank = Bank()
-        self.market = Market()
-        self.date = None
-        self.profit = 0
-        self.birthday = construct_date(day=random.randrange(1,31), month=random.randrange(1,12), year=1990)
-
-    def update(self, date):
-        # If day is the day of your deposit, it is time to adjust percents
-        for d in self.deposits:
-            if d.day == date.day:
-                self.bank.update_deposits(self.deposits)
-        for d in self.loans:
-            if d.day == date.day:
-                self.bank.update_loans(self.loans)
-        # If it is a day of payment, make payments
-        self.date = date
-        if date in self.deposits:
-            self.get_payment(date)
-        if date in self.loans:
-            self.pay_loan(date)
-
-    def get_payment(self, date):
-        payment = self.deposits.pop(date)
-        self.total_money += payment
-        self.profit += payment
-
-    def pay_loan(self, date):
-        payment = self.loans.pop(date)
-        self.total_money -= payment
-        self.profit -= payment
-
-    def new_deposit(self, amount, term):
-        if amount < self.total_money:
-            month = (self.date.month + term) % 12
-            if month < self.date.month:
-                year = self.date.year + 1
-            else:
-                year = self.date.year
-            return_date = construct_date(self.date.day, month, year)
-            self.deposits.update({return_date: amount})
-            self.total_money -= amount
-            self.profit -= amount
-            return True
-        else:
-            return False
-
-    def new_loan(self, amount, term):
-        if amount < self.total_money:
-            month = (self.date.month + term) % 12
-            if month < self.date.month:
-                year = self.date.year + 1
-            else:
-                year = self.date.year
-            return_date = construct_date(self.date.day, month, year)
-            self.loans.update({return_date: amount})
-            self.total_money += amount
-            self.profit += amount
-            return True
-        else:
-            return False
-
-    def get_month_deposits(self, month):
-        amount = 0
-        for deposit, money in self.deposits.items():
-            if deposit.month == month:
-                amount += money
-        return amount
-
-    def get_month_loans(self, month):
-        amount = 0
-        for loan, money in self.loans.items():
-            if loan.month == month:
-                amount += money
-        return amount
-
-    def buy_car(self, car, price):
-        if price < self.total_money:
-            self.total_money -= price
-            self.profit -= price
-            self.property['car'] = car
-            return True
-        return False
-
-    def buy_apartment(self, apt, price):
-        if price < self.total_money:
-            self.total_money -= price
-            self.profit -= price
-            self.property['apt'] = apt
-            return True
-        return False
-
-    def buy_oil(self, amount, price):
-        total_price = amount * price
-        if total_price < self.total_money:
-            self.total_money -= total_price
-            self.profit -= total_price
-            self.property['oil'] += amount
-            self.oil_benefit['bought'] += amount
-            self.oil_benefit['benefit'] -= total_price
-            return True
-        return False
-
-    def buy_land(self, amount, price):
-        total_price = amount * price
-        if total_price < self.total_money:
-            self.total_money -= total_price
-            self.profit -= total_price
-            self.property['land'] += amount
-            self.land_benefit['bought'] += amount
-            self.land_benefit['benefit'] -= total_price
-            return True
-        return False
-
-    def sell_land(self, amount, price):
-        total_money = amount * price
-        self.total_money += total_money
-        self.profit += total_money
-        self.property['land'] -= amount
-        self.land_benefit['sold'] += amount
-        self.land_benefit['benefit'] += total_money
-
-    def sell_oil(self, amount, price):
-        total_money = amount * price
-        self.total_money += total_money
-        self.profit += total_money
-        self.property['oil'] -= amount
-        self.oil_benefit['sold'] += amount
-        self.oil_benefit['benefit'] += total_money
-
-    def sell_apt(self, price):
-        if price:
-            self.total_money += price
-            self.profit += price
-            self.property['apt'] = None
-
-    def sell_car(self, price):
-        if price:
-            self.total_money += price
-            self.profit += price
-            self.property['car'] = None
-
-    def is_enough_money(self, amount):
-        if self.total_money > amount:
-            return True
-        return False
-
-    def pay_income_tax(self, rate):
-        if self.profit > 0:
-            amount = self.profit * rate // 100
-            self.total_money -= amount
-            self.profit = - amount
-            return amount
-        self.profit = 0
+    def own_order(self):
+        # The exchange cancelled an order that met the player's own one
+        self.alert(" Простите ", ("Заявка снята: она встретилась с вашей же заявкой",), lambda key: self.close())
 
 
 class MenuPanel(Panel):
@@ -309,21 +130,18 @@ class MenuPanel(Panel):
         self.width = self._count_width() + 4
         self.begin_x = parent_width // 2 - self.width // 2
 
+    def draw_frame(self):
+        self.panel.bkgd(' ', console.color_pair(BLACK_WHITE))
+
     def add_content(self):
-        if not self.panel:
-            self.create_panel()
-        count_len = 0
-        for key in self.options:
-            count_len += len(key) + 1 + len(self.options[key]) + 1
-        self.panel.bkgd(' ', curses.color_pair(BLACK_WHITE))
         y = 0
         x = 2
         for key in self.options:
             s = '%s' % (key)
-            self.panel.addstr(y, x, s, curses.color_pair(RED_WHITE))
+            self.put(y, x, s, console.color_pair(RED_WHITE))
             x += len(s)
             s = ':%s ' % (self.options[key])
-            self.panel.addstr(y, x, s)
+            self.put(y, x, s)
             x += len(s)
 
 
@@ -331,32 +149,31 @@ class TaxPanel(Panel, Observer):
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(TaxPanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
-        self.loan_rate = INITIAL_LOAN_RATE
-        self.deposit_rate = INITIAL_DEPOSIT_RATE
-        self.income_tax = INITIAL_INCOME_TAX
+        self.bank = kwargs.pop('bank')
+        self.loan_rate = self.bank.loan_rate
+        self.deposit_rate = self.bank.deposit_rate
         self.replacement_cost = INITIAL_REPLACEMENT_COST
-        self.user = kwargs.pop('user')
+        self.tax = kwargs.pop('tax')
+
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.bkgd(' ', console.color_pair(BLACK_CYAN))
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
 
     def add_content(self):
-        if not self.panel:
-            self.create_panel()
-        self.panel.clear()
-        self.panel.bkgd(' ', curses.color_pair(BLACK_CYAN))
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
         loan_rate_str = 'Процент под кредит: %s' % self.loan_rate
         deposit_rate_str = 'Процент под долг: %s' % self.deposit_rate
-        income_tax_str = 'Подоходный налог: %s' % self.income_tax
+        income_tax_str = 'Подоходный налог: %s' % self.tax.income_tax
         replacement_cost_str = 'ВС: %s' % self.replacement_cost
-        self.panel.addstr(1, 2, loan_rate_str)
-        self.panel.addstr(2, 2, deposit_rate_str)
-        self.panel.addstr(3, 2, income_tax_str)
-        self.panel.addstr(4, 2, replacement_cost_str)
-        self.panel.refresh()
+        self.put(1, 2, loan_rate_str)
+        self.put(2, 2, deposit_rate_str)
+        self.put(3, 2, income_tax_str)
+        self.put(4, 2, replacement_cost_str)
 
     def update(self, date):
-        if date.day == 1:
-            self.user.pay_income_tax(self.income_tax)
-            self.show()
+        # Month close: this month's rates
+        self.loan_rate = self.bank.loan_rate
+        self.deposit_rate = self.bank.deposit_rate
 
 
 class FinancePanel(Panel, Observer):
@@ -367,31 +184,30 @@ class FinancePanel(Panel, Observer):
         self.house_rate = INITIAL_HOUSE_RATE
         self.land_rate = INITIAL_LAND_RATE
 
-    def add_content(self):
-        if not self.panel:
-            self.create_panel()
-        self.panel.clear()
-        self.panel.bkgd(' ', curses.color_pair(BLACK_CYAN))
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.bkgd(' ', console.color_pair(BLACK_CYAN))
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
         height, width = self.panel.getmaxyx()
+        self.panel.addstr(5, 2, '_' * (width - 4))
+
+    def add_content(self):
         money_str = 'У вас на счету: %s %s' % (
             self.user.total_money, human_money(self.user.total_money))
-        deposit_str = 'Вам должны: %s %s' % (
-            sum(self.user.deposits.values()), human_money(sum(self.user.deposits.values())))
-        loan_str = 'Вы должны: %s %s' % (
-            sum(self.user.loans.values()), human_money(sum(self.user.loans.values())))
+        deposits = self.user.get_deposits()
+        loans = self.user.get_loans()
+        deposit_str = 'Вам должны: %s %s' % (deposits, human_money(deposits))
+        loan_str = 'Вы должны: %s %s' % (loans, human_money(loans))
         month_income_str = 'Итого прибыль: %s %s' % (
             self.user.profit, human_money(self.user.profit))
         house_rate_str = 'Плата за дом: %s%%' % self.house_rate
         land_rate_str = 'Плата за землю: %s%%' % self.land_rate
-        self.panel.addstr(1, 2, money_str)
-        self.panel.addstr(2, 2, deposit_str)
-        self.panel.addstr(3, 2, loan_str)
-        self.panel.addstr(4, 2, month_income_str)
-        self.panel.addstr(5, 2, '_' * (width - 4))
-        self.panel.addstr(6, 2, house_rate_str)
-        self.panel.addstr(7, 2, land_rate_str)
-        self.panel.refresh()
+        self.put(1, 2, money_str)
+        self.put(2, 2, deposit_str)
+        self.put(3, 2, loan_str)
+        self.put(4, 2, month_income_str)
+        self.put(6, 2, house_rate_str)
+        self.put(7, 2, land_rate_str)
 
     def update(self, date):
         pass
@@ -401,24 +217,29 @@ class DatePanel(Panel, Observer):
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(DatePanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
-        self.date = DATE
+        self.date = kwargs.get('date', DATE)
+
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.bkgd(' ', console.color_pair(BLACK_CYAN))
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
 
     def add_content(self):
-        self.panel.clear()
         date_str = 'Сегодня: %s' % self.date.strftime('%d-%b-%Y')
         weekday_str = self.date.strftime('%A')
-        self.panel.bkgd(' ', curses.color_pair(BLACK_CYAN))
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        self.panel.addstr(1, self.width // 2 - len(date_str) // 2, date_str)
-        self.panel.addstr(2, self.width // 2 - len(weekday_str) // 2, weekday_str)
-        self.panel.refresh()
+        self.put(1, self.width // 2 - len(date_str) // 2, date_str)
+        # Weekday names differ in length, so the centred text moves
+        weekday_x = self.width // 2 - len(weekday_str) // 2
+        self.put(2, 1, ' ' * (weekday_x - 1) + weekday_str)
 
     def update(self, date):
         self.date = date
-        self.show()
 
 
 class BankPanel(Panel):
+    bindings = {
+        KEY_ESC: 'close',
+    }
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(BankPanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
@@ -435,18 +256,10 @@ class BankPanel(Panel):
                 return 4
             return 5
 
-    def show(self):
-        super(BankPanel, self).show()
-        key = self.panel.getch()
-        if key:
-            self.ask_for_choice()
-
-    def add_content(self):
-        if not self.panel:
-            self.create_panel()
-        self.panel.clear()
-        self.panel.bkgd(' ', curses.color_pair(WHITE_BLUE))
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.bkgd(' ', console.color_pair(WHITE_BLUE))
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
         bank_name = ' Банк Ivanov & Co. '
         self.panel.addstr(0, self.width // 2 - len(bank_name) // 2, bank_name)
         self.panel.addstr(2, 1, '+')
@@ -456,6 +269,9 @@ class BankPanel(Panel):
         self.add_payments_table()
         self.panel.addstr(6, 2, '_' * (self.width - 4))
 
+    def add_content(self):
+        pass
+
     def add_payments_table(self):
         m = 1
         for i in range(5, self.width, self.width // 6):
@@ -468,63 +284,100 @@ class BankPanel(Panel):
             self.panel.addstr(5, i, str(self.user.get_month_loans(m + 6)))
             m += 1
 
-    def ask_for_deposit(self):
-        self.panel.addstr(7, 2, 'Какую сумму вы хотели бы дать? ')
-        self.panel.refresh()
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount):
-            self.panel.addstr(8, 2, 'На какой срок (1-11 месяцев)? ')
-            curses.echo()
-            term = self.panel.getstr()
-            if validate_int(term) and validate_month(term):
-                self.user.new_deposit(int(amount), int(term))
-        curses.noecho()
-
-    def ask_for_loan(self):
-        self.panel.addstr(7, 2, 'Какую сумму вы хотели бы взять? ')
-        self.panel.refresh()
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount):
-            self.panel.addstr(8, 2, 'На какой срок (1-11 месяцев)? ')
-            curses.echo()
-            term = self.panel.getstr()
-            if validate_int(term) and validate_month(term):
-                self.user.new_loan(int(amount), int(term))
-        curses.noecho()
+    def default_key(self, key):
+        # Any other key under the table
+        self.ask_for_choice()
 
     def ask_for_choice(self):
         title = ' Вы хотите '
         question = 'взять [1] или дать [0] деньги под проценты?'
-        width = len(question) + 4
-        choice_panel = self.panel.derwin(5, width, self.height // 2 - 3, self.width // 2 - width // 2)
-        choice_panel.touchwin()
-        choice_panel.clear()
-        choice_panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        choice_panel.addstr(0, width // 2 - len(title) // 2, title, WHITE_BLUE)
-        choice_panel.addstr(2, width // 2 - len(question) // 2, question, WHITE_BLUE)
-        key = choice_panel.getch()
-        del choice_panel
-        self.panel.touchwin()
-        self.add_content()
+        self.alert(title, (question,), self.choose, console.color_pair(WHITE_BLUE))
+
+    def choose(self, key):
+        self.draw_frame()
         if key == KEY_0:
             self.ask_for_deposit()
         elif key == KEY_1:
             self.ask_for_loan()
         else:
-            self.hide()
+            self.close()
 
+    def ask_for_deposit(self):
+        self.ask(7, 2, 'Какую сумму вы хотели бы дать? ', partial(self.ask_for_term, self.user.new_deposit))
+
+    def ask_for_loan(self):
+        self.ask(7, 2, 'Какую сумму вы хотели бы взять? ', partial(self.ask_for_term, self.user.new_loan))
+
+    def ask_for_term(self, open_account, amount):
+        if not validate_int(amount):
+            self.close()
+            return
+        self.ask(8, 2, 'На какой срок (1-11 месяцев)? ', partial(self.sign, open_account, amount))
+
+    def sign(self, open_account, amount, term):
+        if validate_int(term) and validate_month(term):
+            open_account(int(amount), int(term))
+        self.close()
+
+
+class MarketAptMenu(Menu):
+    # Apartments are on the right, Left goes back to the cars
+    bindings = dict(Menu.bindings)
+    bindings[curses.KEY_LEFT] = bindings.pop(curses.KEY_RIGHT)
+
+
+class CatalogItem(object):
+    # A good on sale, id is its place in the catalog
+    __slots__ = ('id', 'name', 'price')
+
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
 
-class MarketMenu(Menu):
-    bg_color = curses.COLOR_BLUE
-    fg_color = curses.COLOR_BLACK
-    highlighted_bg_color = curses.COLOR_WHITE
-    highlighted_fg_color = curses.COLOR_BLACK
 
+class CatalogView(object):
+    # Market goods with their menu rows, in catalog order so a menu
+    # position is the item id. Rebuilt only after the market reprices.
 
-class MarketAptMenu(MarketMenu):
-    deactivate_key = curses.KEY_LEFT
+    def __init__(self, market):
+        self.market = market
+        self.version = None
+        self.cars = ()
+        self.apartments = ()
+        self.car_rows = ()
+        self.apt_rows = ()
+        self.row_width = None
+
+    @staticmethod
+    def _items(catalog, prices):
+        return tuple(CatalogItem(i, name, prices[i]) for i, name in enumerate(catalog.names))
+
+    # Price column of a menu row
+    PRICE_WIDTH = 6
+
+    @classmethod
+    def _rows(cls, items, width):
+        # Formatted when the menu shows them
+        return ItemSource(len(items), lambda i: '{name:<{width}}{price:>{price_width}}'.format(
+            name=items[i].name,
+            width=width,
+            price=items[i].price,
+            price_width=cls.PRICE_WIDTH,
+        ))
+
+    def refresh(self):
+        market = self.market
+        if self.version == market.version:
+            return False
+        width = max(market.count_apts_width(), market.count_cars_width())
+        self.cars = self._items(market.cars, market.car_prices)
+        self.apartments = self._items(market.apartments, market.apt_prices)
+        self.car_rows = self._rows(self.cars, width)
+        self.apt_rows = self._rows(self.apartments, width)
+        self.row_width = width + self.PRICE_WIDTH
+        self.version = market.version
+        return True
 
 
 class MarketPanel(Panel):
@@ -533,182 +386,197 @@ class MarketPanel(Panel):
         super(MarketPanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
         self.user = kwargs.get('user')
         self.title = ' Рынок '
-        self.market = Market()
+        self.market = kwargs.get('market')
         self.car_pos = 1
         self.apt_pos = 0
-
-    @staticmethod
-    def _parse_item_string(s):
-        name, price = s.split()
-        return name, int(price)
+        self.catalog = CatalogView(self.market)
+        # Long catalogs scroll inside the box
+        rows = self.height - 4
+        self.car_menu = Menu((), None, 3, 2, height=rows)
+        self.apt_menu = MarketAptMenu((), None, 3, self.width // 2 + 4, active=False, height=rows)
+        self.menus = None
 
     def purchase_response(self, response):
         title = "Продавец-консультант"
-        self.panel.clear()
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
+        self.panel.erase()
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
         self.panel.addstr("")
-        self.panel.bkgd(' ', curses.color_pair(CYAN_BLUE))
+        self.panel.bkgd(' ', console.color_pair(CYAN_BLUE))
         self.panel.addstr(
-            0, self.width // 2 - len(title) // 2, title, curses.color_pair(WHITE_BLUE)
+            0, self.width // 2 - len(title) // 2, title, console.color_pair(WHITE_BLUE)
         )
         self.panel.addstr(
-            self.height // 2 - 1, self.width // 2 - len(response) // 2, response, curses.color_pair(WHITE_BLUE)
+            self.height // 2 - 1, self.width // 2 - len(response) // 2, response, console.color_pair(WHITE_BLUE)
         )
 
-    def add_content(self):
-        self.panel.clear()
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        self.panel.bkgd(' ', curses.color_pair(CYAN_BLUE))
+    def opened(self):
+        self.choose()
+
+    def choose(self):
+        # The menus take the keys until chosen() gets the purchase
+        if self.catalog.refresh():
+            self.car_menu.items = self.catalog.car_rows
+            self.apt_menu.items = self.catalog.apt_rows
+            self.car_menu.item_width = self.apt_menu.item_width = self.catalog.row_width
+        # The panel window is new every time the market opens
+        self.car_menu.screen = self.apt_menu.screen = self.panel
+        self.car_menu.activate()
+        self.apt_menu.deactivate()
+        if self.menus is None:
+            self.menus = MultipleMenu((self.car_menu, self.apt_menu), self.chosen)
+        self.menus.active_menu = 0
+        self.dispatcher.push(self.menus)
+        self.menus.start()
+
+    def chosen(self, item_id, menu):
+        if item_id == -1:
+            self.close()
+            return
+        if menu is self.car_menu:
+            item = self.catalog.cars[item_id]
+            bought = self.user.buy_car(item.name, item.price)
+        else:
+            item = self.catalog.apartments[item_id]
+            bought = self.user.buy_apartment(item.name, item.price)
+
+        if bought:
+            self.purchase_response(' Поздравляем с покупкой! ')
+        else:
+            self.purchase_response(' Без денег не продаем! ')
+
+    def default_key(self, key):
+        # Any key after the purchase
+        self.close()
+
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.panel.bkgd(' ', console.color_pair(CYAN_BLUE))
         self.panel.addstr(
-            0, self.width // 2 - len(self.title) // 2, self.title, curses.color_pair(WHITE_BLUE)
+            0, self.width // 2 - len(self.title) // 2, self.title, console.color_pair(WHITE_BLUE)
         )
         table_headers = ('А. Автомобили', 'D. Дома')
         self.panel.addstr(
-            1, 2, table_headers[0], curses.color_pair(MAGENTA_BLUE)
+            1, 2, table_headers[0], console.color_pair(MAGENTA_BLUE)
         )
         self.panel.addstr(
-            1, self.width - 10 - len(table_headers[1]), table_headers[1], curses.color_pair(MAGENTA_BLUE)
+            1, self.width - 10 - len(table_headers[1]), table_headers[1], console.color_pair(MAGENTA_BLUE)
         )
 
-        # Make strings for menu
-        max_width = max(self.market.count_apts_width(), self.market.count_cars_width())
-        cars_items = tuple('{car:<{max_width}}{price:>6}'.format(
-            car=car,
-            max_width=max_width,
-            price = self.market.cars[car]['price']
-        ) for car in self.market.cars)
-        apts_items = tuple('{apt:<{max_width}}{price:>6}'.format(
-            apt=apt,
-            max_width=max_width,
-            price=self.market.apartments[apt]['price']
-        ) for apt in self.market.apartments)
-        # Instantiate menus
-        car_menu = MarketMenu(cars_items, self.panel, 3, 2)
-        apt_menu = MarketAptMenu(apts_items, self.panel, 3, self.width // 2 + 4, active=False)
-        menus = MultipleMenu((car_menu, apt_menu))
-        # Get result
-        res, menu = menus.start()
-        if res == -1:
-            return
-        item, price = self._parse_item_string(menu.items[res])
-
-        if item in self.market.cars:
-            bought = self.user.buy_car(item, price)
-
-        if item in self.market.apartments:
-            bought = self.user.buy_apartment(item, price)
-
-        if bought:
-            self.purchase_response(' Поздравляем с покупкой! ')
-        else:
-            self.purchase_response(' Без денег не продаем! ')
+    def add_content(self):
+        pass
 
 
-class StockExchangePanel(Panel, Observer):
-    oil_price = 0
-    land_price = 0
-    prices = [None] * 12
+class StockExchangePanel(Panel):
     open = True
+    bindings = {
+        KEY_ESC: 'close',
+        KEY_Z: 'ask_for_land',
+        KEY_N: 'ask_for_oil',
+        KEY_C: 'cancel_orders',
+    }
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(StockExchangePanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
         self.user = kwargs.get('user')
-        self.update_prices(DATE.month)
+        self.exchange = kwargs.get('exchange')
 
-    def update_oil(self, increment=None):
-        if increment is None:
-            self.oil_price = random.randrange(*OIL_PRICE_RANGE)
+    @property
+    def oil_price(self):
+        return self.exchange.oil_price
 
-    def update_land(self, increment=None):
-        if increment is None:
-            self.land_price = random.randrange(*LAND_PRICE_RANGE)
+    @property
+    def land_price(self):
+        return self.exchange.land_price
 
-    def update_prices(self, month):
-        self.update_oil()
-        self.update_land()
-        self.prices[month - 1] = (self.oil_price, self.land_price)
+    @property
+    def prices(self):
+        return self.exchange.prices
 
-    def add_content(self):
-        self.panel.clear()
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        self.panel.bkgd(' ', curses.color_pair(CYAN_BLUE))
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.panel.bkgd(' ', console.color_pair(CYAN_BLUE))
         title = ' Биржа '
-        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        for month, coord in enumerate(range(5, self.width - 5, (self.width - 5) // 12 )):
-            self.panel.addstr(1, coord, str(month + 1), curses.color_pair(BLACK_BLUE))
-            if self.prices[month] is not None:
-                self.panel.addstr(2, coord, str(self.prices[month][1]), curses.color_pair(WHITE_BLUE))
-                self.panel.addstr(3, coord, '{:>3}'.format(self.prices[month][0]), curses.color_pair(WHITE_BLUE))
-        self.panel.addstr(4, 1, '_' * (self.width - 10), curses.color_pair(WHITE_BLUE))
+        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        step = (self.width - 10) // 12
+        for month, prices in enumerate(self.prices):
+            coord = 5 + month * step
+            self.panel.addstr(1, coord, str(month + 1), console.color_pair(BLACK_BLUE))
+            if prices is not None:
+                self.panel.addstr(2, coord, str(prices[1]), console.color_pair(WHITE_BLUE))
+                self.panel.addstr(3, coord, '{:>3}'.format(prices[0]), console.color_pair(WHITE_BLUE))
+        self.panel.addstr(4, 1, '_' * (self.width - 10), console.color_pair(WHITE_BLUE))
         self.panel.addstr(
-            5, 1, 'Z. Земля   -   {} за акр'.format(self.land_price), curses.color_pair(YELLOW_BLUE) | curses.A_BOLD
+            5, 1, 'Z. Земля   -   {} за акр'.format(self.land_price), console.color_pair(YELLOW_BLUE) | curses.A_BOLD
         )
         self.panel.addstr(
-            6, 1, 'N. Нефть   -   {} за баррель'.format(self.oil_price), curses.color_pair(YELLOW_BLUE) | curses.A_BOLD
+            6, 1, 'N. Нефть   -   {} за баррель'.format(self.oil_price), console.color_pair(YELLOW_BLUE) | curses.A_BOLD
         )
+        self.panel.addstr(7, 1, self.year_summary(), console.color_pair(WHITE_BLUE))
+        orders = sum(len(book.owned(self.user)) for book in self.exchange.books)
         self.panel.addstr(
-            8, 1, 'ESC - выход без покупки; Z, N - покупка', curses.color_pair(YELLOW_BLUE) | curses.A_BOLD
+            8, 1, 'ESC - выход без покупки; Z, N - покупка; C - снять заявки ({})'.format(orders),
+            console.color_pair(YELLOW_BLUE) | curses.A_BOLD
         )
-        self.wait_for_key()
 
-    def wait_for_key(self):
-        key = self.panel.getch()
-        if key == KEY_ESC:
-            return
-        elif key == KEY_Z:
-            self.panel.addstr(9, 1, "Сколько акров: ", curses.color_pair(YELLOW_BLUE) | curses.A_BOLD)
-            self.ask_for_land()
-        elif key == KEY_N:
-            self.panel.addstr(9, 1, "Сколько баррелей: ", curses.color_pair(YELLOW_BLUE) | curses.A_BOLD)
-            self.ask_for_oil()
-        else:
-            self.wait_for_key()
+    def add_content(self):
+        pass
+
+    def year_summary(self):
+        year = self.exchange.date.year
+        land = self.exchange.history.land.summary(year)
+        oil = self.exchange.history.oil.summary(year)
+        return 'За {} год: земля {}-{}, в среднем {:.0f}; нефть {}-{}, в среднем {:.0f}'.format(
+            year, land[0], land[1], land[2], oil[0], oil[1], oil[2]
+        )
+
+    def cancel_orders(self):
+        for good, book in enumerate(self.exchange.books):
+            for order in book.owned(self.user):
+                self.exchange.cancel(self.user, good, order.id)
+        self.close()
 
     def not_enough_money(self):
-        title = " Простите "
-        message = "У вас нет столько денег"
-        width = len(message) + 7
-        height = 5
-        win = self.panel.derwin(height, width, self.height // 2 - height // 2, self.width // 2 - width // 2)
-        win.clear()
-        win.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        win.addstr(0, width // 2 - len(title) // 2, title)
-        win.addstr(2, width // 2 - len(message) // 2, message)
-        win.keypad(1)
-        key = win.getch()
-        if key:
-            return
+        self.alert(" Простите ", ("У вас нет столько денег",), lambda key: self.close())
 
-    def ask_for_land(self):
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount) and self.user.is_enough_money(int(amount) * self.land_price):
-            self.user.buy_land(int(amount), self.land_price)
-            curses.noecho()
-        else:
-            curses.noecho()
+    def buy(self, good, market_price, question):
+        attr = console.color_pair(YELLOW_BLUE) | curses.A_BOLD
+        self.ask(9, 1, question, partial(self.ask_for_price, good, market_price), attr)
+
+    def ask_for_price(self, good, market_price, amount):
+        if not validate_int(amount):
             self.not_enough_money()
             return
-
-    def ask_for_oil(self):
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount) and self.user.is_enough_money(int(amount) * self.oil_price):
-            self.user.buy_oil(int(amount), self.oil_price)
-            curses.noecho()
+        # Empty price is a market order
+        attr = console.color_pair(YELLOW_BLUE) | curses.A_BOLD
+        self.ask(9, 30, "Цена (Enter - по рынку): ", partial(self.place, good, market_price, amount), attr)
+
+    def place(self, good, market_price, amount, price):
+        price = int(price) if validate_int(price) else None
+        if self.user.is_enough_money(int(amount) * (price or market_price)):
+            order, fills = self.exchange.place(self.user, good, BUY, int(amount), price)
+            if order.cancelled:
+                self.own_order()
+            else:
+                self.close()
         else:
-            curses.noecho()
             self.not_enough_money()
-            return
 
-    def update(self, date):
-        if date.month == 1 and date.day == 1:
-            self.prices.clear()
-        if date.day == 1:
-            self.update_prices(date.month)
+    def ask_for_land(self):
+        self.buy(self.exchange.LAND, self.land_price, "Сколько акров: ")
+
+    def ask_for_oil(self):
+        self.buy(self.exchange.OIL, self.oil_price, "Сколько баррелей: ")
 
 
 class PropertyPanel(Panel):
+    bindings = {
+        KEY_Z: 'ask_for_land',
+        KEY_N: 'ask_for_oil',
+        KEY_D: 'sell_apt',
+        KEY_A: 'sell_car',
+    }
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(PropertyPanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
@@ -716,201 +584,252 @@ class PropertyPanel(Panel):
         self.market = kwargs.get('market')
         self.se = kwargs.get('stock_exchange')
 
-    def add_content(self):
-        self.panel.clear()
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        self.panel.bkgd(' ', curses.color_pair(CYAN_BLUE))
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.panel.bkgd(' ', console.color_pair(CYAN_BLUE))
         title = ' Ваша собственность '
         col1_title = 'Наименование'
         col2_title = 'Цена'
         user_actions = 'ESC - выход без продажи; D, A, Z, N - продажа'
-        apt_price = self.market.apartments.get(self.user.property['apt'], {}).get('price', 0)
-        car_price = self.market.cars.get(self.user.property['car'], {}).get('price', 0)
-        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(1, 5, col1_title, curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(1, self.width - len(col2_title) - 25, col2_title, curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(2, 1, "_" * (self.width - 25), curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(3, 1, 'D. ' + self.user.property['apt'], curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(3, self.width - len(col2_title) - 25, str(apt_price), curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(4, 1, 'A. Автомобиль ' + self.user.property['car'], curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(4, self.width - len(col2_title) - 25, str(car_price), curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(5, 1, 'Z. Земли ', curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        apt_price = self.market.price(self.user.property.apt)
+        car_price = self.market.price(self.user.property.car)
+        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(1, 5, col1_title, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(1, self.width - len(col2_title) - 25, col2_title, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(2, 1, "_" * (self.width - 25), console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(3, 1, 'D. ' + self.user.property.apt, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(3, self.width - len(col2_title) - 25, str(apt_price), console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(4, 1, 'A. Автомобиль ' + self.user.property.car, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(4, self.width - len(col2_title) - 25, str(car_price), console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(5, 1, 'Z. Земли ', console.color_pair(WHITE_BLUE) | curses.A_BOLD)
         self.panel.addstr(
-            5, self.width - len(col2_title) - 25, str(self.user.property['land']), curses.color_pair(WHITE_BLUE) | curses.A_BOLD
+            5, self.width - len(col2_title) - 25, str(self.user.property.land), console.color_pair(WHITE_BLUE) | curses.A_BOLD
         )
-        self.panel.addstr(6, 1, 'N. Нефти', curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(6, 1, 'N. Нефти', console.color_pair(WHITE_BLUE) | curses.A_BOLD)
         self.panel.addstr(
-            6, self.width - len(col2_title) - 25, str(self.user.property['oil']), curses.color_pair(WHITE_BLUE) | curses.A_BOLD
+            6, self.width - len(col2_title) - 25, str(self.user.property.oil), console.color_pair(WHITE_BLUE) | curses.A_BOLD
         )
         self.panel.addstr(
-            8, 1, user_actions, curses.color_pair(MAGENTA_BLUE)
+            8, 1, user_actions, console.color_pair(MAGENTA_BLUE)
         )
-        self.wait_for_key()
-        return
 
-    def wait_for_key(self):
-        key = self.panel.getch()
-        if key == KEY_ESC:
-            return
-        elif key == KEY_Z:
-            self.panel.addstr(9, 1, "Сколько акров: ", curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-            self.ask_for_land()
-        elif key == KEY_N:
-            self.panel.addstr(9, 1, "Сколько баррелей: ", curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-            self.ask_for_oil()
-        elif key == KEY_D:
-            self.user.sell_apt(self.market.apartments.get(self.user.property['apt'], {}).get('price', 0))
-        elif key == KEY_A:
-            self.user.sell_car(self.market.apartments.get(self.user.property['car'], {}).get('price', 0))
+    def add_content(self):
+        pass
 
-    def ask_for_land(self):
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount) and self.user.property['land'] >= int(amount):
-            self.user.sell_land(int(amount), self.se.land_price)
-            curses.noecho()
+    def default_key(self, key):
+        # Esc and the keys that sell nothing
+        self.close()
+
+    def sell_apt(self):
+        self.user.sell_apt(self.market.price(self.user.property.apt))
+        self.close()
+
+    def sell_car(self):
+        self.user.sell_car(self.market.price(self.user.property.car))
+        self.close()
+
+    def sell(self, good, question):
+        attr = console.color_pair(WHITE_BLUE) | curses.A_BOLD
+        self.ask(9, 1, question, partial(self.place, good), attr)
+
+    def place(self, good, amount):
+        name = self.se.GOODS[good]
+        if validate_int(amount) and getattr(self.user.property, name) >= int(amount):
+            order, fills = self.se.place(self.user, good, SELL, int(amount))
+            if order.cancelled:
+                self.own_order()
+            else:
+                self.close()
         else:
-            curses.noecho()
-            self.not_enough('land')
-            return
+            self.not_enough(name)
+
+    def ask_for_land(self):
+        self.sell(self.se.LAND, "Сколько акров: ")
 
     def ask_for_oil(self):
-        curses.echo()
-        amount = self.panel.getstr()
-        if validate_int(amount) and self.user.property['oil'] >= int(amount):
-            self.user.sell_oil(int(amount), self.se.oil_price)
-            curses.noecho()
-        else:
-            curses.noecho()
-            self.not_enough('oil')
-            return
+        self.sell(self.se.OIL, "Сколько баррелей: ")
 
     def not_enough(self, item):
         dct = {
             'oil': 'У вас нет столько нефти',
             'land': 'У вас нет столько земли'
         }
-        title = " Простите "
-        message = dct[item]
-        width = len(message) + 7
-        height = 5
-        win = self.panel.derwin(height, width, self.height // 2 - height // 2, self.width // 2 - width // 2)
-        win.clear()
-        win.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        win.addstr(0, width // 2 - len(title) // 2, title)
-        win.addstr(2, width // 2 - len(message) // 2, message)
-        win.keypad(1)
-        key = win.getch()
-        if key:
-            return
+        self.alert(" Простите ", (dct[item],), lambda key: self.close())
 
 
-class SecretaryPanel(Panel, Observer):
+class SecretaryPanel(Panel):
 
     def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
         super(SecretaryPanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
         self.user = kwargs.get('user')
-        self.heat = random.randrange(*HEAT_RANGE)
+        self.secretary = kwargs.get('secretary')
 
-    def add_content(self):
-        self.panel.clear()
-        self.panel.box(curses.ACS_VLINE, curses.ACS_HLINE)
-        self.panel.bkgd(' ', curses.color_pair(CYAN_BLUE))
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.panel.bkgd(' ', console.color_pair(CYAN_BLUE))
         title = ' Секретарь '
         msg = 'На отопление дома и энергетическую установку в этом месяце'
-        msg2 = 'понадобится %s баррл. нефти' % self.heat
+        msg2 = 'понадобится %s баррл. нефти' % self.secretary.heat
         birthday_msg = 'Ваш день рождения %s-%s' % (self.user.birthday.day, self.user.birthday.month,)
-        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, curses.color_pair(WHITE_BLUE) | curses.A_BOLD)
-        self.panel.addstr(1, 1, msg, curses.color_pair(CYAN_BLUE) | curses.A_BOLD)
-        self.panel.addstr(2, 1, msg2, curses.color_pair(CYAN_BLUE) | curses.A_BOLD)
-        self.panel.addstr(3, 1, birthday_msg, curses.color_pair(CYAN_BLUE) | curses.A_BOLD)
-        self.panel.addstr(4, 1, '-' * (self.width - 20), curses.color_pair(CYAN_BLUE) | curses.A_BOLD)
+        self.panel.addstr(0, self.width // 2 - len(title) // 2, title, console.color_pair(WHITE_BLUE) | curses.A_BOLD)
+        self.panel.addstr(1, 1, msg, console.color_pair(CYAN_BLUE) | curses.A_BOLD)
+        self.panel.addstr(2, 1, msg2, console.color_pair(CYAN_BLUE) | curses.A_BOLD)
+        self.panel.addstr(3, 1, birthday_msg, console.color_pair(CYAN_BLUE) | curses.A_BOLD)
+        self.panel.addstr(4, 1, '-' * (self.width - 20), console.color_pair(CYAN_BLUE) | curses.A_BOLD)
         columns = ('', 'Куплено', 'Продано', 'Результат')
         oil_row = (
-            'Нефти', self.user.oil_benefit['bought'], self.user.oil_benefit['sold'], self.user.oil_benefit['benefit']
+            'Нефти', self.user.oil_benefit.bought, self.user.oil_benefit.sold, self.user.oil_benefit.benefit
         )
         land_row = (
-            'Земли', self.user.land_benefit['bought'], self.user.land_benefit['sold'], self.user.land_benefit['benefit']
+            'Земли', self.user.land_benefit.bought, self.user.land_benefit.sold, self.user.land_benefit.benefit
         )
         for i in range(len(columns)):
             self.panel.addstr(
-                5, (self.width - 10) // 4 * (i + 1) - 8, columns[i], curses.color_pair(BLACK_BLUE)
+                5, (self.width - 10) // 4 * (i + 1) - 8, columns[i], console.color_pair(BLACK_BLUE)
             )
             self.panel.addstr(
-                6, (self.width - 10) // 4 * (i + 1) - 8, str(oil_row[i]), curses.color_pair(BLACK_BLUE)
+                6, (self.width - 10) // 4 * (i + 1) - 8, str(oil_row[i]), console.color_pair(BLACK_BLUE)
             )
             self.panel.addstr(
-                7, (self.width - 10) // 4 * (i + 1) - 8, str(land_row[i]), curses.color_pair(BLACK_BLUE)
+                7, (self.width - 10) // 4 * (i + 1) - 8, str(land_row[i]), console.color_pair(BLACK_BLUE)
             )
-        key = self.panel.getch()
 
-    def update(self, msg):
-        if msg.day == 1:
-            self.heat = random.randrange(*HEAT_RANGE)
+    def add_content(self):
+        pass
+
+    def default_key(self, key):
+        self.close()
 
 
-class Screen(Observer):
+class ProfilePanel(Panel):
+    # Timing overlay, toggled with P: milliseconds per observer update,
+    # panel show, frame and key press
 
-    def __init__(self, stdscr):
+    def __init__(self, height, width, begin_y, begin_x, *args, **kwargs):
+        super(ProfilePanel, self).__init__(height, width, begin_y, begin_x, *args, **kwargs)
+        self.profiler = kwargs.get('profiler')
+        self.title = ' Профиль, мс '
+
+    def draw_frame(self):
+        self.panel.erase()
+        self.panel.bkgd(' ', console.color_pair(BLACK_CYAN))
+        self.panel.box(console.ACS_VLINE, console.ACS_HLINE)
+        self.panel.addstr(0, self.width // 2 - len(self.title) // 2, self.title)
+        self.panel.addstr(1, 2, '%-28s%7s%8s%8s%8s%8s' % ('', 'n', 'avg', 'p50', 'p99', 'max'))
+
+    def add_content(self):
+        summaries = self.profiler.summaries()[:self.height - 3]
+        for y, (name, summary) in enumerate(summaries, 2):
+            self.put(y, 2, '%-28s%7d%8.2f%8.2f%8.2f%8.2f' % (
+                name[:28],
+                summary['count'],
+                summary['mean'] * 1000,
+                summary['p50'] * 1000,
+                summary['p99'] * 1000,
+                summary['max'] * 1000,
+            ))
+
+
+class Screen(KeyHandler, Observer):
+    bindings = {
+        curses.KEY_F1: 'show_bank',
+        curses.KEY_F2: 'show_market',
+        curses.KEY_F3: 'show_stock_exchange',
+        curses.KEY_F4: 'show_property',
+        curses.KEY_F9: 'show_secretary',
+        KEY_P: 'toggle_profile',
+    }
+
+    def __init__(self, stdscr, simulation, report=None):
+        self.report = report if report is not None else StartupReport()
         self.panel = stdscr
         # Ожидание getch() не останавливает время
         self.panel.nodelay(YES)
+        # Prompts echo what they take themselves
+        console.noecho()
+        # Set by the game, open panels take the keys through it
+        self.dispatcher = None
         self.height, self.width = self.panel.getmaxyx()
 
         self.padding = 2
         self.side_panel_width = self.width // 2 - 2 * self.padding
-        init_colors()
+        console.init_colors()
+        self.report.mark('colors')
 
         self.panels = []
 
-        self.panel.bkgd(curses.ACS_CKBOARD, curses.color_pair(BLACK_WHITE))
+        self.panel.bkgd(console.ACS_CKBOARD, console.color_pair(BLACK_WHITE))
         self.panel.refresh()
 
-        self.user = User('Ksenia')
+        self.simulation = simulation
+        self.user = simulation.user
+        self.profiler = Profiler()
+        simulation.date_counter.profiler = self.profiler
+        simulation.month_close.profiler = self.profiler
+        # Panels behind the F-keys are built when first opened
         self.menu = MenuPanel(1, 1, self.height - 1, 2, parent_width=self.width)
-        self.date = DatePanel(4, self.side_panel_width, 2, 2)
-        self.tax = TaxPanel(6, self.side_panel_width, 7, 2, user=self.user)
+        self.date = DatePanel(4, self.side_panel_width, 2, 2, date=simulation.date)
+        self.tax = TaxPanel(6, self.side_panel_width, 7, 2, tax=simulation.tax, bank=simulation.bank)
+        simulation.month_close.register(self.tax)
         self.finance = FinancePanel(
             9, self.width // 2 - 1, 2, self.width // 2, user=self.user
         )
-        self.bank = BankPanel(
+
+        self.panels.append(self.menu)
+        self.panels.append(self.date)
+        self.panels.append(self.tax)
+        self.panels.append(self.finance)
+        self.report.mark('panels')
+
+        self.update_panels()
+        self.report.mark('first frame')
+
+    @cached_property
+    def bank(self):
+        return BankPanel(
             self.height // 2, self.width - 8, self.height // 2 - 4, 4, user=self.user
         )
-        self.market = MarketPanel(
-            12, self.width - 30, self.height // 2 - 4, 15, user=self.user
+
+    @cached_property
+    def market(self):
+        return MarketPanel(
+            12, self.width - 30, self.height // 2 - 4, 15, user=self.user, market=self.simulation.market
         )
-        self.stock_exchange = StockExchangePanel(
-            11, self.width - 12, self.height // 2 - 5, 6, user=self.user
+
+    @cached_property
+    def stock_exchange(self):
+        return StockExchangePanel(
+            11, self.width - 12, self.height // 2 - 5, 6, user=self.user, exchange=self.simulation.exchange
         )
-        self.property = PropertyPanel(
+
+    @cached_property
+    def property(self):
+        return PropertyPanel(
             self.height // 2,
             self.width - 16,
             self.height // 2 - 4, 8,
             user=self.user,
-            market=self.market.market,
-            stock_exchange=self.stock_exchange
+            market=self.simulation.market,
+            stock_exchange=self.simulation.exchange
         )
-        self.secretary = SecretaryPanel(
+
+    @cached_property
+    def secretary(self):
+        return SecretaryPanel(
             self.height // 2,
             self.width - 16,
             self.height // 2 - 4, 8,
-            user=self.user
+            user=self.user,
+            secretary=self.simulation.secretary
         )
 
-        self.panels.append(self.menu)
-        self.panels.append(self.date)
-        self.panels.append(self.tax)
-        self.panels.append(self.finance)
-
-        self.update_panels()
-
-        self.options = {
-            curses.KEY_F1: self.show_bank,
-            curses.KEY_F2: self.show_market,
-            curses.KEY_F3: self.show_stock_exchange,
-            curses.KEY_F4: self.show_property,
-            curses.KEY_F9: self.show_secretary,
-        }
+    @cached_property
+    def profile(self):
+        return ProfilePanel(
+            16, 72, self.height - 18, self.width - 74, profiler=self.profiler
+        )
 
     def update(self, msg):
         self.update_panels()
@@ -920,7 +839,9 @@ class Screen(Observer):
             self.panels.remove(panel)
             panel.hide()
         self.panel.touchwin()
-        self.panel.refresh()
+        self.panel.noutrefresh()
+        for p in self.panels:
+            p.touch()
 
         self.update_panels()
 
@@ -929,74 +850,191 @@ class Screen(Observer):
         self.update_panels()
 
     def update_panels(self):
+        # Panels only stage their changes, the terminal is written once
+        profiler = self.profiler
+        frame_started = time.perf_counter()
+        # Panels over a restaged one are staged again to stay on top of it
+        restaged = []
         for panel in self.panels:
-            panel.show()
-        self.panel.refresh()
+            started = time.perf_counter()
+            if any(panel.overlaps(below) for below in restaged):
+                panel.touch()
+            if panel.show():
+                restaged.append(panel)
+            profiler.record('show.' + type(panel).__name__, time.perf_counter() - started)
+        console.doupdate()
+        profiler.record('frame', time.perf_counter() - frame_started)
+
+    def toggle_profile(self):
+        if self.profile in self.panels:
+            self.disable_panel(self.profile)
+        else:
+            self.enable_panel(self.profile)
+
+    def open_panel(self, panel):
+        # Modal: the panel and whatever it opens take the keys until it
+        # closes, and the game stands still meanwhile
+        panel.screen = self
+        self.enable_panel(panel)
+        self.dispatcher.push(panel)
+        panel.opened()
+
+    def close_panel(self, panel):
+        self.dispatcher.pop(panel)
+        self.disable_panel(panel)
 
     def show_bank(self):
-        self.enable_panel(self.bank)
-        self.panel.nodelay(NO)
-        curses.noecho()
-        self.disable_panel(self.bank)
-        self.panel.nodelay(YES)
+        self.open_panel(self.bank)
 
     def show_market(self):
-        self.enable_panel(self.market)
-        self.panel.nodelay(NO)
-        curses.noecho()
-        self.disable_panel(self.market)
-        self.panel.nodelay(YES)
+        self.open_panel(self.market)
 
     def show_stock_exchange(self):
-        self.enable_panel(self.stock_exchange)
-        self.panel.nodelay(NO)
-        curses.noecho()
-        self.disable_panel(self.stock_exchange)
-        self.panel.nodelay(YES)
+        self.open_panel(self.stock_exchange)
 
     def show_property(self):
-        self.enable_panel(self.property)
-        self.panel.nodelay(NO)
-        curses.noecho()
-        self.disable_panel(self.property)
-        self.panel.nodelay(YES)
+        self.open_panel(self.property)
 
     def show_secretary(self):
-        self.enable_panel(self.secretary)
-        self.panel.nodelay(NO)
-        curses.noecho()
-        self.disable_panel(self.secretary)
-        self.panel.nodelay(YES)
-
-
-def main(stdscr):
+        self.open_panel(self.secretary)
+
+
+class Game(KeyHandler):
+    # Bottom of the key dispatch: speed and exit, the rest goes to the screen
+    bindings = {
+        KEY_PLUS: 'faster',
+        KEY_MINUS: 'slower',
+        KEY_ESC: 'stop',
+    }
+
+    def __init__(self, screen, simulation, tick=TICK, profile_path=None):
+        self.screen = screen
+        self.simulation = simulation
+        self.tick = tick
+        self.dispatcher = Dispatcher(self)
+        screen.dispatcher = self.dispatcher
+        # Timing histograms are appended here every PROFILE_DUMP_INTERVAL
+        self.profile_path = profile_path
+        self.done = None
+        self.finished = False
+
+    def set_tick(self, tick):
+        self.tick = min(max(tick, TICK_RANGE[0]), TICK_RANGE[1])
+
+    def faster(self):
+        self.set_tick(self.tick / 2)
+
+    def slower(self):
+        self.set_tick(self.tick * 2)
+
+    @property
+    def paused(self):
+        # A panel is open
+        return len(self.dispatcher) > 1
+
+    def step(self):
+        if not self.paused:
+            self.simulation.tick()
+
+    async def clock(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.step()
+
+    async def dump_profile(self):
+        while True:
+            await asyncio.sleep(PROFILE_DUMP_INTERVAL)
+            self.screen.profiler.dump(self.profile_path)
+
+    def read_keys(self):
+        # Called as soon as stdin is readable; queue everything curses has,
+        # handle it and draw one frame for the lot
+        dispatcher = self.dispatcher
+        key = self.screen.panel.getch()
+        while key != -1:
+            dispatcher.feed(key)
+            key = self.screen.panel.getch()
+        handled = False
+        while dispatcher.queue and not self.finished:
+            started = time.perf_counter()
+            dispatcher.dispatch()
+            self.screen.profiler.record('input', time.perf_counter() - started)
+            handled = True
+        if handled and not self.finished:
+            self.screen.update_panels()
+
+    def stop(self):
+        self.finished = True
+        if self.done is not None and not self.done.done():
+            self.done.set_result(True)
+
+    def default_key(self, key):
+        self.screen.handle_key(key)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        loop.add_reader(sys.stdin.fileno(), self.read_keys)
+        tasks = [asyncio.ensure_future(self.clock())]
+        if self.profile_path is not None:
+            tasks.append(asyncio.ensure_future(self.dump_profile()))
+        try:
+            await self.done
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+            for task in tasks:
+                task.cancel()
+            if self.profile_path is not None:
+                self.screen.profiler.dump(self.profile_path)
+
+
+def main(stdscr, profile_path=None):
+    report = StartupReport(STARTED)
+    report.mark('import', IMPORTED)
+    report.mark('curses')
     # Hide cursor
-    curses.curs_set(0)
-    screen = Screen(stdscr)
-    date_counter = DateCounter()
-    date_counter.register(screen.date)
-    current_date = DATE
-    date_counter.register(screen.tax)
-    date_counter.register(screen.user)
-    date_counter.register(screen.user.bank)
-    date_counter.register(screen.finance)
-    date_counter.register(screen.stock_exchange)
-    date_counter.register(screen)
-    while True:
-        time.sleep(1)
-        current_date = current_date + TIMEDELTA
-        date_counter.notify(current_date)
-        key = screen.panel.getch()
-        if key in screen.options:
-            if type(screen.options[key]) == list:
-                method, *args = screen.options[key]
-                method(args[0])
-            else:
-                screen.options[key]()
-        elif key == KEY_ESC:
-            curses.endwin()
+    console.curs_set(0)
+    simulation, journal = open_game('Ksenia', SAVE_PATH, JOURNAL_PATH)
+    report.mark('load')
+    screen = Screen(stdscr, simulation, report)
+    save(simulation, SAVE_PATH, journal)
+    simulation.register(screen.date)
+    simulation.register(screen)
+    game = Game(screen, simulation, profile_path=profile_path)
+    asyncio.run(game.run())
+    save(simulation, SAVE_PATH, journal)
+    journal.close()
+    curses.endwin()
+    return report
+
+
+def run_virtual(keys=(), days=30, seed=None, height=40, width=120):
+    # Headless session on the in-memory terminal, for profiling and CI
+    backend = VirtualBackend(height, width, keys)
+    console.use(backend)
+    simulation = Simulation('Ksenia', seed=seed)
+    screen = Screen(backend.stdscr, simulation)
+    simulation.register(screen.date)
+    simulation.register(screen)
+    game = Game(screen, simulation)
+    for _ in range(days):
+        if game.finished:
             break
+        game.step()
+        game.read_keys()
+    return backend
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Commersant')
+    parser.add_argument('--startup', action='store_true', help='Print where the startup time went')
+    parser.add_argument('--profile', metavar='PATH', help='Append timing histograms to PATH')
+    args = parser.parse_args()
+
+    report = curses.wrapper(main, args.profile)
+    if args.startup:
+        print(report.format())
 
 
 if __name__ == '__main__':
-    curses.wrapper(main)
+    _main()
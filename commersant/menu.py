@@ -1,18 +1,53 @@
 # -*- encoding: utf8 -*-
 
-from constants import *
-
+import curses
 
-class Menu(object):
-    bg_color = curses.COLOR_BLACK
-    fg_color = curses.COLOR_WHITE
-    highlighted_bg_color = curses.COLOR_WHITE
-    highlighted_fg_color = curses.COLOR_BLACK
-    deactivate_key = curses.KEY_RIGHT
-    exit_key = KEY_ESC
-
-    def __init__(self, items, screen, begin_y, begin_x, active=True):
+from constants import *
+from dispatch import KeyHandler
+from terminal import console
+
+
+class ItemSource(object):
+    # Rows made on demand, for menus over long lists: row(i) formats item i
+    # and is only called for the rows on screen
+
+    def __init__(self, count, row):
+        self.count = count
+        self.row = row
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.row(i)
+
+
+class Menu(KeyHandler):
+    # Colour pairs set up once by init_colors()
+    color = BLACK_BLUE
+    highlighted_color = BLACK_WHITE
+    # Returned by a key that hands over to the next menu
+    LEAVE = 'leave'
+    bindings = {
+        curses.KEY_UP: 'up',
+        curses.KEY_DOWN: 'down',
+        curses.KEY_PPAGE: 'page_up',
+        curses.KEY_NPAGE: 'page_down',
+        curses.KEY_RIGHT: 'leave',
+        KEY_ESC: 'cancel',
+        KEY_ENTER: 'select',
+        curses.KEY_ENTER: 'select',
+    }
+
+    def __init__(self, items, screen, begin_y, begin_x, active=True, height=None, width=None):
+        # items is any sequence of rows. With height the menu shows that
+        # many rows and scrolls, with width the rows are not measured:
+        # together they let a lazy ItemSource open without formatting it.
         self.items = items
+        self.max_height = height
+        self.item_width = width
         self.width = None
         self.height = None
         self.active = active
@@ -20,99 +55,165 @@ class Menu(object):
             self.pos = None
         else:
             self.pos = 0
+        # First item on screen
+        self.top = 0
         self.panel = None
+        # Window the subwindow was made in
+        self.parent = None
         self.screen = screen
         self.begin_y = begin_y
         self.begin_x = begin_x
-        curses.init_pair(1, self.fg_color, self.bg_color)
-        curses.init_pair(2, self.highlighted_fg_color, self.highlighted_bg_color)
 
     def _count_width(self):
-        self.width = max(len(i) for i in self.items) + 2
+        if self.item_width is not None:
+            self.width = self.item_width + 2
+        else:
+            self.width = max((len(i) for i in self.items), default=0) + 2
 
     def _count_height(self):
         self.height = len(self.items)
-
-    def _item_up(self):
-        if self.pos > 0:
-            self.pos -= 1
-
-    def _item_down(self):
-        if self.pos < len(self.items) - 1:
-            self.pos += 1
+        if self.max_height is not None:
+            self.height = min(self.height, self.max_height)
+        self.height = max(self.height, 1)
+
+    def _scroll(self):
+        # Keep pos on screen, True if the view moved
+        top = self.top
+        if self.pos is not None:
+            if self.pos < self.top:
+                self.top = self.pos
+            elif self.pos >= self.top + self.height:
+                self.top = self.pos - self.height + 1
+        self.top = max(0, min(self.top, len(self.items) - self.height))
+        return self.top != top
+
+    def _draw_row(self, i):
+        if not self.top <= i < self.top + self.height:
+            return
+        if i == self.pos and self.active:
+            color = self.highlighted_color
+        else:
+            color = self.color
+        # Rows are padded, so a row overwrites whatever was there
+        text = self.items[i][:self.width - 2].ljust(self.width - 2)
+        self.panel.addstr(i - self.top, 0, text, console.color_pair(color))
 
     def draw(self):
-        self.panel.clear()
-        for i, text in enumerate(self.items):
-            if i == self.pos and self.active:
-                color = 2
-            else:
-                color = 1
-            self.panel.addstr(i, 0, text, curses.color_pair(color))
-        self.panel.refresh()
+        self._scroll()
+        self.panel.erase()
+        for i in range(self.top, min(self.top + self.height, len(self.items))):
+            self._draw_row(i)
+        self.panel.noutrefresh()
+
+    def move(self, step):
+        # Repaint only the rows that lose and get the highlight, or the
+        # visible rows when the view scrolls
+        if self.pos is None or not self.items:
+            return
+        old = self.pos
+        self.pos = max(0, min(self.pos + step, len(self.items) - 1))
+        if self.pos == old:
+            return
+        if self._scroll():
+            self.draw()
+            return
+        self._draw_row(old)
+        self._draw_row(self.pos)
+        self.panel.noutrefresh()
 
     def attach(self):
+        # The subwindow is made again only in a new window or for a new size
         self._count_height()
         self._count_width()
-        self.panel = self.screen.derwin(self.height, self.width, self.begin_y, self.begin_x)
-        self.panel.keypad(1)
+        if (self.panel is None or self.parent is not self.screen or
+                self.panel.getmaxyx() != (self.height, self.width)):
+            self.panel = self.screen.derwin(self.height, self.width, self.begin_y, self.begin_x)
+            self.panel.keypad(1)
+            self.parent = self.screen
         self.draw()
-        self.screen.refresh()
-
-    def wait_for_key(self):
-        key = None
-        while key != curses.KEY_ENTER and key != KEY_ENTER:
-            key = self.panel.getch()
-            if key == curses.KEY_UP and self.active:
-                self._item_up()
-                self.draw()
-            elif key == curses.KEY_DOWN and self.active:
-                self._item_down()
-                self.draw()
-            elif key == self.deactivate_key and self.active:
-                self.deactivate()
-                self.draw()
-                return
-            elif key == self.exit_key:
-                self.deactivate()
-                self.draw()
-                return -1
+
+    # Key handlers: the position on Enter, -1 on Esc, LEAVE to pass the
+    # keys on, None to stay
+
+    def up(self):
+        self.move(-1)
+
+    def down(self):
+        self.move(1)
+
+    def page_up(self):
+        self.move(-self.height)
+
+    def page_down(self):
+        self.move(self.height)
+
+    def select(self):
+        # Nothing to choose in an empty menu
+        if not self.items:
+            return None
         return self.pos
 
+    def cancel(self):
+        self.deactivate()
+        self.draw()
+        return -1
+
+    def leave(self):
+        self.deactivate()
+        self.draw()
+        return self.LEAVE
+
     def activate(self):
         self.active = True
         self.pos = 0
+        self.top = 0
 
     def deactivate(self):
         self.active = False
         self.pos = None
 
 
-class MultipleMenu(object):
+class MultipleMenu(KeyHandler):
+    # Menus side by side, keys go to the active one. done(result, menu)
+    # gets the choice, result is -1 on Esc.
     active_menu = 0
 
-    def __init__(self, menus):
+    def __init__(self, menus, done=None):
         self.menus = menus
-        self.draw()
+        self.done = done
+        self.result = None
 
     def draw(self):
         for menu in self.menus:
-            menu.attach()
+            menu.draw()
 
     def start(self):
-        res = None
-        while res is None:
+        self.result = None
+        self.menus[self.active_menu].activate()
+        for menu in self.menus:
+            menu.attach()
+
+    def handle_key(self, key):
+        menu = self.menus[self.active_menu]
+        res = menu.handle_key(key)
+        if res == Menu.LEAVE:
+            self.active_menu = (self.active_menu + 1) % len(self.menus)
             self.menus[self.active_menu].activate()
-            self.draw()
-            res = self.menus[self.active_menu].wait_for_key()
-            if res is None:
-                index = (self.active_menu + 1) % len(self.menus)
-                self.active_menu = index
-        return res, self.menus[self.active_menu]
+            self.menus[self.active_menu].draw()
+        elif res is not None:
+            self.finish(res, menu)
+
+    def finish(self, res, menu):
+        self.result = res, menu
+        if self.dispatcher is not None:
+            self.dispatcher.pop(self)
+        if self.done is not None:
+            self.done(res, menu)
 
 
 def _main(stdscr):
     curses.curs_set(0)
+    init_colors()
     stdscr.clear()
     height, width = stdscr.getmaxyx()
     stdscr.addstr(0, width // 2 - 3, 'Hello')
@@ -121,7 +222,12 @@ def _main(stdscr):
     menu1 = Menu(items, stdscr, height // 2, width // 2 - 20)
     menu2 = Menu(items2, stdscr, height // 2, width // 2 + 10, active=False)
     menus = MultipleMenu((menu1, menu2))
-    res, menu = menus.start()
+    menus.start()
+    curses.doupdate()
+    while menus.result is None:
+        menus.handle_key(stdscr.getch())
+        curses.doupdate()
+    res, menu = menus.result
     if res == -1:
         stdscr.addstr(0, 0, 'Вышли с концами!')
     elif res is not None:
@@ -0,0 +1,455 @@
+# -*- encoding: utf8 -*-
+
+from accrual import RateHistory
+from constants import *
+from history import PriceHistory
+from ledger import Ledger
+from observer import Observable, Observer
+from orderbook import BUY, SELL, Fill, Order, OrderBook
+from prices import PricePath, get_model
+from rng import RandomRegistry, RandomStream
+from utils import add_months, construct_date
+
+
+class DateCounter(Observable):
+    pass
+
+
+class Bank(Observer):
+    __slots__ = ('random', 'loan_rate', 'deposit_rate', 'loan_history', 'deposit_history')
+
+    def __init__(self, rng=None):
+        self.random = rng if rng is not None else RandomStream()
+        self.loan_rate = INITIAL_LOAN_RATE
+        self.deposit_rate = INITIAL_DEPOSIT_RATE
+        self.loan_history = RateHistory(DATE, self.loan_rate)
+        self.deposit_history = RateHistory(DATE, self.deposit_rate)
+
+    def update(self, date):
+        if date.day == 1:
+            self.update_rates(date)
+
+    def update_rates(self, date):
+        self.loan_rate = self.random.randint(*BANK_RATE_RANGE)
+        self.deposit_rate = self.random.randint(*BANK_RATE_RANGE)
+        self.loan_history.set_rate(date, self.loan_rate)
+        self.deposit_history.set_rate(date, self.deposit_rate)
+
+    def update_deposits(self, deposits, date):
+        deposits.accrue(date)
+
+    def update_loans(self, loans, date):
+        loans.accrue(date)
+
+
+class Catalog(object):
+    # Names and price ranges of goods, shared by every market. Prices
+    # themselves live in each market as a vector in catalog order.
+    __slots__ = ('names', 'price_ranges', 'index', 'width')
+
+    def __init__(self, items):
+        self.names = tuple(name for name, price_range in items)
+        self.price_ranges = tuple(price_range for name, price_range in items)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.width = max(len(name) for name in self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+CAR_CATALOG = Catalog(CARS)
+APARTMENT_CATALOG = Catalog(APARTMENTS)
+
+
+class Market(Observer):
+    __slots__ = ('cars_path', 'apts_path', 'version')
+    cars = CAR_CATALOG
+    apartments = APARTMENT_CATALOG
+
+    def __init__(self, rng=None, model=None):
+        rng = rng if rng is not None else RandomStream()
+        model = get_model(model)
+        self.cars_path = PricePath(model, self.cars.price_ranges, rng)
+        self.apts_path = PricePath(model, self.apartments.price_ranges, rng)
+        # Bumped on every repricing, views cache their rows until it changes
+        self.version = 0
+        self.update_apartments()
+        self.update_cars()
+
+    @property
+    def car_prices(self):
+        return self.cars_path.prices
+
+    @property
+    def apt_prices(self):
+        return self.apts_path.prices
+
+    def count_cars_width(self):
+        return self.cars.width
+
+    def count_apts_width(self):
+        return self.apartments.width
+
+    def car_price(self, car):
+        return self.car_prices[self.cars.index[car]]
+
+    def apt_price(self, apt):
+        return self.apt_prices[self.apartments.index[apt]]
+
+    def price(self, item):
+        # Price of a car or an apartment, 0 for anything not on sale
+        if item in self.cars:
+            return self.car_price(item)
+        if item in self.apartments:
+            return self.apt_price(item)
+        return 0
+
+    def update(self, date):
+        if date.day == 1:
+            self.update_prices(date)
+
+    def update_prices(self, date):
+        self.update_cars()
+        self.update_apartments()
+
+    def update_cars(self):
+        self.cars_path.advance()
+        self.version += 1
+
+    def update_apartments(self):
+        self.apts_path.advance()
+        self.version += 1
+
+
+class Property(object):
+    __slots__ = ('apt', 'car', 'oil', 'land')
+    # Shown when there is nothing to sell, neither is in a catalog
+    NO_APARTMENT = 'Живу у мамы'
+    NO_CAR = '-'
+
+    def __init__(self):
+        self.apt = self.NO_APARTMENT
+        self.car = self.NO_CAR
+        self.oil = 0
+        self.land = 0
+
+
+class Benefit(object):
+    # Trading result for one commodity
+    __slots__ = ('bought', 'sold', 'benefit')
+
+    def __init__(self):
+        self.bought = 0
+        self.sold = 0
+        self.benefit = 0
+
+
+class User(Observer):
+    __slots__ = (
+        'random', 'name', 'scores', 'total_money', 'property', 'oil_benefit', 'land_benefit',
+        'marriage', 'sick', 'bank', 'deposits', 'loans', 'date', 'profit', 'birthday', 'journal',
+    )
+
+    def __init__(self, name, rng=None):
+        if rng is None:
+            rng = RandomRegistry()
+        self.random = rng.stream('user')
+        self.name = name
+        self.scores = 0
+        self.total_money = self.random.randrange(*USER_MONEY_RANGE)
+        self.property = Property()
+        self.oil_benefit = Benefit()
+        self.land_benefit = Benefit()
+        self.marriage = False
+        self.sick = False
+        self.bank = Bank(rng.stream('bank'))
+        self.deposits = Ledger(self.bank.deposit_history, {construct_date(day=4): 10000}, start=DATE)
+        self.loans = Ledger(self.bank.loan_history)
+        self.date = None
+        self.profit = 0
+        self.birthday = construct_date(
+            day=self.random.randrange(1,31), month=self.random.randrange(1,12), year=1990)
+        self.journal = None
+
+    def update(self, date):
+        # Adjust percents of the deposits and loans whose day is today
+        self.bank.update_deposits(self.deposits, date)
+        self.bank.update_loans(self.loans, date)
+        # If it is a day of payment, make payments
+        self.date = date
+        for d in self.deposits.due(date):
+            self.get_payment(d)
+        for d in self.loans.due(date):
+            self.pay_loan(d)
+        if date.day == 1:
+            self.deposits.prune(date)
+            self.loans.prune(date)
+
+    def record(self, op, *args):
+        # Successful transactions go to the journal, if the game keeps one
+        if self.journal is not None:
+            self.journal.record(op, *args)
+
+    def get_payment(self, date):
+        payment = self.deposits.pop(date)
+        self.total_money += payment
+        self.profit += payment
+
+    def pay_loan(self, date):
+        payment = self.loans.pop(date)
+        self.total_money -= payment
+        self.profit -= payment
+
+    def new_deposit(self, amount, term):
+        if amount < self.total_money:
+            return_date = add_months(self.date, term)
+            self.deposits.add(self.date, return_date, amount)
+            self.total_money -= amount
+            self.profit -= amount
+            self.record('new_deposit', amount, term)
+            return True
+        else:
+            return False
+
+    def new_loan(self, amount, term):
+        if amount < self.total_money:
+            return_date = add_months(self.date, term)
+            self.loans.add(self.date, return_date, amount)
+            self.total_money += amount
+            self.profit += amount
+            self.record('new_loan', amount, term)
+            return True
+        else:
+            return False
+
+    def get_deposits(self):
+        return self.deposits.total_amount()
+
+    def get_loans(self):
+        return self.loans.total_amount()
+
+    def get_month_deposits(self, month):
+        return self.deposits.month_amount(month)
+
+    def get_month_loans(self, month):
+        return self.loans.month_amount(month)
+
+    def buy_car(self, car, price):
+        if price < self.total_money:
+            self.total_money -= price
+            self.profit -= price
+            self.property.car = car
+            self.record('buy_car', car, price)
+            return True
+        return False
+
+    def buy_apartment(self, apt, price):
+        if price < self.total_money:
+            self.total_money -= price
+            self.profit -= price
+            self.property.apt = apt
+            self.record('buy_apartment', apt, price)
+            return True
+        return False
+
+    # Oil and land change hands on the exchange; these only settle its
+    # fills, the exchange journals the orders themselves
+
+    def buy_oil(self, amount, price):
+        total_price = amount * price
+        if total_price < self.total_money:
+            self.total_money -= total_price
+            self.profit -= total_price
+            self.property.oil += amount
+            self.oil_benefit.bought += amount
+            self.oil_benefit.benefit -= total_price
+            return True
+        return False
+
+    def buy_land(self, amount, price):
+        total_price = amount * price
+        if total_price < self.total_money:
+            self.total_money -= total_price
+            self.profit -= total_price
+            self.property.land += amount
+            self.land_benefit.bought += amount
+            self.land_benefit.benefit -= total_price
+            return True
+        return False
+
+    def sell_land(self, amount, price):
+        total_money = amount * price
+        self.total_money += total_money
+        self.profit += total_money
+        self.property.land -= amount
+        self.land_benefit.sold += amount
+        self.land_benefit.benefit += total_money
+
+    def sell_oil(self, amount, price):
+        total_money = amount * price
+        self.total_money += total_money
+        self.profit += total_money
+        self.property.oil -= amount
+        self.oil_benefit.sold += amount
+        self.oil_benefit.benefit += total_money
+
+    def sell_apt(self, price):
+        if price:
+            self.total_money += price
+            self.profit += price
+            self.property.apt = Property.NO_APARTMENT
+            self.record('sell_apt', price)
+
+    def sell_car(self, price):
+        if price:
+            self.total_money += price
+            self.profit += price
+            self.property.car = Property.NO_CAR
+            self.record('sell_car', price)
+
+    def is_enough_money(self, amount):
+        if self.total_money > amount:
+            return True
+        return False
+
+    def pay_income_tax(self, rate):
+        if self.profit > 0:
+            amount = self.profit * rate // 100
+            self.total_money -= amount
+            self.profit = - amount
+            return amount
+        self.profit = 0
+
+
+class StockExchange(Observer):
+    # Players trade oil and land through an order book per commodity.
+    # Whatever the books can not fill is dealt by the house at the month's
+    # price, and resting orders that this price reaches are filled when
+    # it changes.
+
+    # Positions in the price path and the books
+    OIL = 0
+    LAND = 1
+    GOODS = ('oil', 'land')
+
+    def __init__(self, start=DATE, rng=None, years=PRICE_HISTORY_YEARS, model=None):
+        self.random = rng if rng is not None else RandomStream()
+        self.path = PricePath(get_model(model), (OIL_PRICE_RANGE, LAND_PRICE_RANGE), self.random)
+        self.books = (OrderBook(), OrderBook())
+        self.date = start
+        self.history = PriceHistory(years)
+        self.update_prices(start)
+
+    @property
+    def oil_price(self):
+        return self.path.prices[self.OIL]
+
+    @property
+    def land_price(self):
+        return self.path.prices[self.LAND]
+
+    @property
+    def prices(self):
+        # Chart row of the current year
+        return self.history.year(self.date.year)
+
+    def update_prices(self, date):
+        self.path.advance()
+        self.date = date
+        self.history.append(date, self.oil_price, self.land_price)
+        for good in (self.OIL, self.LAND):
+            self.fill_crossed(good)
+
+    def settle(self, good, buy, sell, price, amount):
+        # Fills are paid through the users; returns the order that fails
+        name = self.GOODS[good]
+        if buy.owner is not None and not buy.owner.is_enough_money(price * amount):
+            return buy
+        if sell.owner is not None and getattr(sell.owner.property, name) < amount:
+            return sell
+        if buy.owner is not None:
+            getattr(buy.owner, 'buy_' + name)(amount, price)
+        if sell.owner is not None:
+            getattr(sell.owner, 'sell_' + name)(amount, price)
+        return None
+
+    def _house_fill(self, good, order):
+        price = self.path.prices[good]
+        house = Order(0, None, SELL if order.side == BUY else BUY, price, order.remaining)
+        buy, sell = (order, house) if order.side == BUY else (house, order)
+        amount = order.remaining
+        if self.settle(good, buy, sell, price, amount) is not None:
+            return None
+        order.filled += amount
+        return Fill(buy, sell, price, amount)
+
+    def place(self, user, good, side, amount, price=None):
+        # Limit order, or market order without a price. Returns the order
+        # and its fills; a limit order that is not filled keeps resting,
+        # unless it met the user's own order and was cancelled.
+        book = self.books[good]
+        order = book.order(user, side, price, amount)
+        user.record('place_order', good, side, amount, price or 0)
+        fills = book.match(order, lambda buy, sell, p, a: self.settle(good, buy, sell, p, a))
+        if order.cancelled:
+            return order, fills
+        if order.remaining and order.crosses(self.path.prices[good]):
+            fill = self._house_fill(good, order)
+            if fill is not None:
+                fills.append(fill)
+        if order.remaining and price is not None:
+            book.rest(order)
+        return order, fills
+
+    def cancel(self, user, good, order_id):
+        order = self.books[good].orders.get(order_id)
+        if order is None or order.owner is not user:
+            return False
+        self.books[good].cancel(order_id)
+        user.record('cancel_order', good, order_id)
+        return True
+
+    def fill_crossed(self, good):
+        # A new house price fills the resting orders it reaches
+        book = self.books[good]
+        for side in (BUY, SELL):
+            for order in book.crossed(side, self.path.prices[good]):
+                self._house_fill(good, order)
+                book.cancel(order.id)
+
+    def update(self, date):
+        if date.day == 1:
+            self.update_prices(date)
+
+
+class TaxOffice(Observer):
+
+    def __init__(self, user):
+        self.user = user
+        self.income_tax = INITIAL_INCOME_TAX
+
+    def update(self, date):
+        if date.day == 1:
+            self.charge(date)
+
+    def charge(self, date):
+        # Tax on the month's profit, which starts over
+        return self.user.pay_income_tax(self.income_tax)
+
+
+class Secretary(object):
+    # Monthly chores: oil burnt by the house and the power plant
+    __slots__ = ('random', 'heat')
+
+    def __init__(self, rng=None):
+        self.random = rng if rng is not None else RandomStream()
+        self.update_heat()
+
+    def update_heat(self, date=None):
+        self.heat = self.random.randrange(*HEAT_RANGE)
@@ -1,22 +1,62 @@
 # -*- encoding: utf8 -*-
 
+import heapq
+import time
+
 from abc import ABCMeta, abstractmethod
 
 
+# Cadences for date messages; any date object subscribes to that day only
+DAILY = 'daily'
+MONTHLY = 'monthly'
+YEARLY = 'yearly'
+
+
 class Observable(metaclass=ABCMeta):
+    # With a timing.Profiler, every update is timed as update.<class>
+    profiler = None
 
     def __init__(self):
         self.observers = []
+        self.cadences = {DAILY: [], MONTHLY: [], YEARLY: []}
+        self.dates = {}
 
-    def register(self, o):
+    def register(self, o, cadence=DAILY):
+        # Observers are kept with their registration number, so observers
+        # from different cadences are still notified in registration order
+        entry = (len(self.observers), o)
         self.observers.append(o)
+        if cadence in self.cadences:
+            self.cadences[cadence].append(entry)
+        else:
+            self.dates.setdefault(cadence, []).append(entry)
+
+    def due(self, msg):
+        groups = [self.cadences[DAILY]]
+        if getattr(msg, 'day', None) == 1:
+            groups.append(self.cadences[MONTHLY])
+            if msg.month == 1:
+                groups.append(self.cadences[YEARLY])
+        if msg in self.dates:
+            groups.append(self.dates.pop(msg))
+        if len(groups) == 1:
+            return [o for _, o in groups[0]]
+        return [o for _, o in heapq.merge(*groups)]
 
     def notify(self, msg):
-        for o in self.observers:
+        profiler = self.profiler
+        if profiler is None:
+            for o in self.due(msg):
+                o.update(msg)
+            return
+        for o in self.due(msg):
+            started = time.perf_counter()
             o.update(msg)
+            profiler.record('update.' + type(o).__name__, time.perf_counter() - started)
 
 
 class Observer(metaclass=ABCMeta):
+    __slots__ = ()
 
     @abstractmethod
     def update(self, msg):
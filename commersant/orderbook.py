@@ -0,0 +1,145 @@
+# -*- encoding: utf8 -*-
+
+import heapq
+
+from collections import deque
+
+
+BUY = 0
+SELL = 1
+
+
+class Order(object):
+    # A limit order, or a market order when price is None. cancelled is
+    # set when the rest of it was dropped instead of trading with its
+    # owner's own resting order.
+    __slots__ = ('id', 'owner', 'side', 'price', 'amount', 'filled', 'cancelled')
+
+    def __init__(self, id, owner, side, price, amount):
+        self.id = id
+        self.owner = owner
+        self.side = side
+        self.price = price
+        self.amount = amount
+        self.filled = 0
+        self.cancelled = False
+
+    @property
+    def remaining(self):
+        return self.amount - self.filled
+
+    def crosses(self, price):
+        if self.price is None:
+            return True
+        return price <= self.price if self.side == BUY else price >= self.price
+
+
+class Fill(object):
+    __slots__ = ('buy', 'sell', 'price', 'amount')
+
+    def __init__(self, buy, sell, price, amount):
+        self.buy = buy
+        self.sell = sell
+        self.price = price
+        self.amount = amount
+
+
+class OrderBook(object):
+    # Resting limit orders of one commodity with price-time priority.
+    # Every price level is a FIFO queue; the best levels come from a heap
+    # of prices per side (bids negated). A price stays in its heap once,
+    # emptied levels are dropped from it when they reach the top.
+
+    def __init__(self):
+        self.levels = ({}, {})
+        self.heaps = ([], [])
+        self.queued = (set(), set())
+        self.orders = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def order(self, owner, side, price, amount):
+        self.next_id += 1
+        return Order(self.next_id - 1, owner, side, price, amount)
+
+    def _key(self, side, price):
+        return -price if side == BUY else price
+
+    def best(self, side):
+        # Best resting order of a side, or None
+        levels = self.levels[side]
+        heap = self.heaps[side]
+        while heap:
+            price = self._key(side, heap[0])
+            if price in levels:
+                return levels[price][0]
+            heapq.heappop(heap)
+            self.queued[side].discard(price)
+        return None
+
+    def rest(self, order):
+        levels = self.levels[order.side]
+        if order.price not in levels:
+            levels[order.price] = deque()
+            if order.price not in self.queued[order.side]:
+                self.queued[order.side].add(order.price)
+                heapq.heappush(self.heaps[order.side], self._key(order.side, order.price))
+        levels[order.price].append(order)
+        self.orders[order.id] = order
+
+    def cancel(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            levels = self.levels[order.side]
+            queue = levels[order.price]
+            queue.remove(order)
+            if not queue:
+                del levels[order.price]
+        return order
+
+    def match(self, order, settle):
+        # Fill an incoming order against the other side at the resting
+        # prices. settle(buy, sell, price, amount) moves the money and
+        # goods and returns the order that could not pay or deliver, if
+        # any: a resting one is cancelled, an incoming one stops matching.
+        fills = []
+        other = SELL if order.side == BUY else BUY
+        while order.remaining:
+            maker = self.best(other)
+            if maker is None or not order.crosses(maker.price):
+                break
+            if maker.owner is not None and maker.owner is order.owner:
+                # No trading with yourself: the incoming order stops, what
+                # it filled so far stays
+                order.cancelled = True
+                break
+            amount = min(order.remaining, maker.remaining)
+            buy, sell = (order, maker) if order.side == BUY else (maker, order)
+            failed = settle(buy, sell, maker.price, amount)
+            if failed is maker:
+                self.cancel(maker.id)
+                continue
+            if failed is not None:
+                break
+            order.filled += amount
+            maker.filled += amount
+            if not maker.remaining:
+                self.cancel(maker.id)
+            fills.append(Fill(buy, sell, maker.price, amount))
+        return fills
+
+    def crossed(self, side, price):
+        # Resting orders of a side that would trade at price, best first
+        while True:
+            order = self.best(side)
+            if order is None or not order.crosses(price):
+                return
+            yield order
+
+    def owned(self, owner):
+        return [o for o in self.orders.values() if o.owner is owner]
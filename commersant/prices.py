@@ -0,0 +1,186 @@
+# -*- encoding: utf8 -*-
+
+from abc import ABCMeta, abstractmethod
+from array import array
+
+import numpy as np
+
+from constants import *
+
+
+# Months of prices generated in one go
+PRICE_PATH_MONTHS = 60
+
+
+class PriceModel(object, metaclass=ABCMeta):
+    # How a price moves from month to month inside its range. Models only
+    # hold parameters and are shared; the state of a series is its last
+    # price and the current regime.
+    #
+    # paths() draws many series at once with numpy: all the noise for the
+    # block is drawn up front, then each month is a few array operations.
+    # low and high are numbers, or arrays with the range of every series.
+
+    def paths(self, rng, count, months, low, high, price=None, regime=None):
+        # (count, months) prices and the regimes at the end of the block
+        if price is None:
+            price = rng.integers(low, high, size=count)
+        # Steps work in place
+        price = np.array(price, dtype=np.int64)
+        if regime is None:
+            regime = np.zeros(count, dtype=np.int8)
+        noise = self.noise(rng, (months, count), low, high)
+        result = np.empty((months, count), dtype=np.int64)
+        for month in range(months):
+            price, regime = self.steps(price, regime, noise, month, low, high)
+            result[month] = price
+        return result.T, regime
+
+    @abstractmethod
+    def noise(self, rng, shape, low, high):
+        pass
+
+    @abstractmethod
+    def steps(self, price, regime, noise, month, low, high):
+        pass
+
+
+class UniformModel(PriceModel):
+    # Independent draws every month
+    name = 'uniform'
+
+    def noise(self, rng, shape, low, high):
+        return rng.integers(low, high, size=shape)
+
+    def steps(self, price, regime, noise, month, low, high):
+        price[:] = noise[month]
+        return price, regime
+
+
+class RandomWalkModel(PriceModel):
+    # Moves by at most `step` of the range a month, reflected at the bounds
+    name = 'walk'
+
+    def __init__(self, step=0.1):
+        self.step_size = step
+
+    def noise(self, rng, shape, low, high):
+        bound = np.maximum(1, ((np.asarray(high) - low) * self.step_size).astype(np.int64))
+        return rng.integers(-bound, bound + 1, size=shape)
+
+    def steps(self, price, regime, noise, month, low, high):
+        # Reflect at both bounds: low + |p - low|, then top - |top - p|
+        top = high - 1
+        price += noise[month]
+        np.subtract(price, low, out=price)
+        np.abs(price, out=price)
+        np.add(price, low, out=price)
+        np.subtract(top, price, out=price)
+        np.abs(price, out=price)
+        np.subtract(top, price, out=price)
+        return price, regime
+
+
+class MeanRevertingModel(PriceModel):
+    # Pulled towards the middle of the range with normal noise
+    name = 'mean'
+
+    def __init__(self, speed=0.3, volatility=0.1):
+        self.speed = speed
+        self.volatility = volatility
+
+    def noise(self, rng, shape, low, high):
+        return rng.normal(0, self.volatility * (np.asarray(high) - low), size=shape)
+
+    def steps(self, price, regime, noise, month, low, high):
+        mean = (low + high) / 2
+        moved = price + self.speed * (mean - price) + noise[month]
+        np.rint(moved, out=moved)
+        np.clip(moved, low, high - 1, out=moved)
+        price[:] = moved
+        return price, regime
+
+
+class RegimeSwitchingModel(PriceModel):
+    # Markov chain over other models: every month the market may switch
+    # to the next regime, then the price moves by the current one
+    name = 'regime'
+
+    def __init__(self, regimes=None, switch=0.1):
+        if regimes is None:
+            regimes = (MeanRevertingModel(0.3, 0.03), RandomWalkModel(0.25))
+        self.regimes = regimes
+        self.switch = switch
+
+    def noise(self, rng, shape, low, high):
+        switched = rng.random(size=shape) < self.switch
+        return switched, [model.noise(rng, shape, low, high) for model in self.regimes]
+
+    def steps(self, price, regime, noise, month, low, high):
+        switched, noises = noise
+        regime = np.where(switched[month], (regime + 1) % len(self.regimes), regime).astype(np.int8)
+        moves = [
+            model.steps(price.copy(), regime, model_noise, month, low, high)[0]
+            for model, model_noise in zip(self.regimes, noises)
+        ]
+        return np.choose(regime, moves), regime
+
+
+MODELS = {
+    model.name: model
+    for model in (UniformModel, RandomWalkModel, MeanRevertingModel, RegimeSwitchingModel)
+}
+DEFAULT_MODEL = 'uniform'
+
+
+def get_model(model=None):
+    # A model instance, or one of MODELS by name
+    if model is None:
+        model = DEFAULT_MODEL
+    if isinstance(model, str):
+        return MODELS[model]()
+    return model
+
+
+class PricePath(object):
+    # Current prices of several goods plus the months generated ahead.
+    # upcoming holds PRICE_PATH_MONTHS rows of len(ranges) prices, made in
+    # one paths() call. The numpy generator is seeded from the game's
+    # stream each time, so the stream's state is all a save needs.
+    __slots__ = ('model', 'ranges', 'low', 'high', 'random', 'prices', 'regimes', 'upcoming', 'cursor')
+
+    def __init__(self, model, ranges, random):
+        self.model = model
+        self.ranges = ranges
+        self.low = np.array([low for low, high in ranges], dtype=np.int64)
+        self.high = np.array([high for low, high in ranges], dtype=np.int64)
+        self.random = random
+        rng = self._generator()
+        self.prices = array('I', rng.integers(self.low, self.high).tolist())
+        self.regimes = array('B', [0] * len(ranges))
+        self.upcoming = array('I')
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def _generator(self):
+        return np.random.default_rng(self.random.getrandbits(64))
+
+    def generate(self, months=PRICE_PATH_MONTHS):
+        paths, regimes = self.model.paths(
+            self._generator(), len(self.ranges), months, self.low, self.high,
+            price=self.prices, regime=np.array(self.regimes, dtype=np.int8)
+        )
+        # Month by month, goods side by side
+        self.upcoming = array('I', paths.T.ravel().tolist())
+        self.regimes[:] = array('B', regimes.tolist())
+        self.cursor = 0
+
+    def advance(self):
+        n = len(self.ranges)
+        if self.cursor * n >= len(self.upcoming):
+            self.generate()
+        self.prices[:] = self.upcoming[self.cursor * n:(self.cursor + 1) * n]
+        self.cursor += 1
+        return self.prices
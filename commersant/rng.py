@@ -0,0 +1,31 @@
+# -*- encoding: utf8 -*-
+
+import random
+
+
+class RandomStream(random.Random):
+    pass
+
+
+class RandomRegistry(object):
+    # One independent stream per subsystem, all derived from a single seed,
+    # so a run is reproduced by its seed no matter which subsystems draw
+
+    def __init__(self, seed=None):
+        if seed is None:
+            # Saves keep the seed as a signed 64-bit number
+            seed = random.SystemRandom().randrange(2 ** 63)
+        self.seed = seed
+        self.streams = {}
+
+    def stream(self, name):
+        if name not in self.streams:
+            self.streams[name] = RandomStream('%s/%s' % (self.seed, name))
+        return self.streams[name]
+
+    def getstate(self):
+        return {name: stream.getstate() for name, stream in self.streams.items()}
+
+    def setstate(self, state):
+        for name, stream_state in state.items():
+            self.stream(name).setstate(stream_state)
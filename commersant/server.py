@@ -0,0 +1,321 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import asyncio
+import curses
+import itertools
+import logging
+import time
+
+from collections import deque
+
+from constants import *
+from main import Game, Screen
+from simulation import Simulation
+from terminal import VirtualBackend, console
+from timing import StartupReport
+
+
+log = logging.getLogger('commersant.server')
+
+HOST = '127.0.0.1'
+PORT = 2323
+SCREEN_SIZE = (40, 120)
+# Clock resolution of the server, every session ticks at its own speed
+RESOLUTION = 0.05
+# Sessions served before the clock yields to pending input
+BATCH = 64
+# Pending connections, players tend to arrive all at once
+BACKLOG = 1024
+# How long the start of an escape sequence waits for the rest, like
+# curses' ESCDELAY
+ESCAPE_DELAY = 0.1
+# Output a client may leave unread before its frames are held back and
+# merged into one
+WRITE_BUFFER_LIMIT = 64 * 1024
+
+# Telnet
+IAC = 255
+SB = 250
+SE = 240
+WILL = 251
+ECHO = 1
+SUPPRESS_GO_AHEAD = 3
+# Echo and line editing on our side: the client sends every key at once
+HANDSHAKE = bytes([IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD])
+# Clear the screen and hide the cursor
+GREETING = b'\x1b[2J\x1b[?25l'
+GOODBYE = b'\x1b[0m\x1b[2J\x1b[H\x1b[?25h'
+
+ESCAPES = {
+    b'\x1bOP': curses.KEY_F1,
+    b'\x1bOQ': curses.KEY_F2,
+    b'\x1bOR': curses.KEY_F3,
+    b'\x1bOS': curses.KEY_F4,
+    b'\x1b[11~': curses.KEY_F1,
+    b'\x1b[12~': curses.KEY_F2,
+    b'\x1b[13~': curses.KEY_F3,
+    b'\x1b[14~': curses.KEY_F4,
+    b'\x1b[15~': curses.KEY_F5,
+    b'\x1b[17~': curses.KEY_F6,
+    b'\x1b[18~': curses.KEY_F7,
+    b'\x1b[19~': curses.KEY_F8,
+    b'\x1b[20~': curses.KEY_F9,
+    b'\x1b[A': curses.KEY_UP,
+    b'\x1b[B': curses.KEY_DOWN,
+    b'\x1b[C': curses.KEY_RIGHT,
+    b'\x1b[D': curses.KEY_LEFT,
+}
+
+
+def strip_telnet(data):
+    # Drop option negotiation, keep the keys
+    keys = bytearray()
+    i = 0
+    while i < len(data):
+        byte = data[i]
+        if byte != IAC:
+            keys.append(byte)
+            i += 1
+        elif i + 1 < len(data) and data[i + 1] == IAC:
+            keys.append(IAC)
+            i += 2
+        elif i + 1 < len(data) and data[i + 1] == SB:
+            end = data.find(bytes([IAC, SE]), i)
+            i = len(data) if end == -1 else end + 2
+        elif i + 1 < len(data) and data[i + 1] >= WILL:
+            i += 3
+        else:
+            i += 2
+    return bytes(keys)
+
+
+# Starts of the escape sequences, to tell one cut off by the end of a read
+ESCAPE_PREFIXES = {seq[:i] for seq in ESCAPES for i in range(1, len(seq))}
+
+
+class KeyDecoder(object):
+    # Bytes of one connection to curses key codes. A read can end in the
+    # middle of an escape sequence; the prefix waits for the next read,
+    # or is taken as the bare keys once it is ESCAPE_DELAY old.
+
+    def __init__(self):
+        self.pending = b''
+        self.age = 0
+        # The read ended in CR, a LF or NUL at the start of the next is
+        # part of the same Enter
+        self.after_cr = False
+
+    def feed(self, data):
+        data = self.pending + data
+        self.pending = b''
+        self.age = 0
+        if self.after_cr and data[:1] in (b'\n', b'\0'):
+            data = data[1:]
+        self.after_cr = False
+        keys = []
+        i = 0
+        while i < len(data):
+            if data[i] == KEY_ESC:
+                for seq, key in ESCAPES.items():
+                    if data.startswith(seq, i):
+                        keys.append(key)
+                        i += len(seq)
+                        break
+                else:
+                    if data[i:] in ESCAPE_PREFIXES:
+                        self.pending = data[i:]
+                        break
+                    keys.append(KEY_ESC)
+                    i += 1
+            elif data[i] == ord('\r'):
+                # CR LF and CR NUL are one Enter
+                keys.append(KEY_ENTER)
+                if i + 1 == len(data):
+                    self.after_cr = True
+                i += 2 if data[i + 1:i + 2] in (b'\n', b'\0') else 1
+            else:
+                keys.append(data[i])
+                i += 1
+        return keys
+
+    def expire(self, dt):
+        # Keys of a prefix nothing followed, e.g. Esc pressed on its own
+        if not self.pending:
+            return []
+        self.age += dt
+        if self.age < ESCAPE_DELAY:
+            return []
+        keys = list(self.pending)
+        self.pending = b''
+        return keys
+
+
+class Session(object):
+    # One player: its own simulation, panels and screen buffer.
+    # Nothing here blocks, the server calls in when there is work.
+
+    def __init__(self, number, writer, seed=None, size=SCREEN_SIZE):
+        self.report = StartupReport()
+        self.number = number
+        self.writer = writer
+        self.backend = VirtualBackend(*size, output=writer.write)
+        self.elapsed = 0
+        self.closed = False
+        self.decoder = KeyDecoder()
+        self.activate()
+        self.simulation = Simulation('Игрок %d' % number, seed=seed)
+        self.report.mark('simulation')
+        self.screen = Screen(self.backend.stdscr, self.simulation, self.report)
+        self.simulation.register(self.screen.date)
+        self.simulation.register(self.screen)
+        self.game = Game(self.screen, self.simulation)
+
+    def activate(self):
+        # Panels draw through the shared console, point it at this player
+        console.use(self.backend)
+
+    @property
+    def finished(self):
+        return self.game.finished
+
+    def throttle(self):
+        # A slow client gets no new frames until it has read the old ones
+        held = self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT
+        if self.backend.held and not held:
+            self.backend.held = False
+            self.backend.doupdate()
+        self.backend.held = held
+
+    def feed(self, data):
+        self.backend.feed(*self.decoder.feed(strip_telnet(data)))
+        self.activate()
+        self.throttle()
+        self.game.read_keys()
+
+    def advance(self, dt):
+        self.elapsed += dt
+        self.activate()
+        self.throttle()
+        keys = self.decoder.expire(dt)
+        if keys:
+            self.backend.feed(*keys)
+            self.game.read_keys()
+        while self.elapsed >= self.game.tick and not self.finished:
+            self.elapsed -= self.game.tick
+            self.game.step()
+
+
+class Server(object):
+
+    def __init__(self, host=HOST, port=PORT, seed=None, size=SCREEN_SIZE):
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.size = size
+        self.sessions = deque()
+        self.numbers = itertools.count(1)
+
+    def open_session(self, writer):
+        number = next(self.numbers)
+        seed = None if self.seed is None else self.seed + number
+        writer.write(HANDSHAKE + GREETING)
+        return Session(number, writer, seed=seed, size=self.size)
+
+    def close_session(self, session):
+        if session.closed:
+            return
+        session.closed = True
+        self.sessions.remove(session)
+        if not session.writer.is_closing():
+            session.writer.write(GOODBYE)
+            session.writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            session = self.open_session(writer)
+        except Exception:
+            log.exception('Could not start a session')
+            writer.close()
+            return
+        self.sessions.append(session)
+        log.info(
+            'Session %d opened in %.1f ms, %d online',
+            session.number, session.report.total * 1000, len(self.sessions)
+        )
+        log.debug('Session %d %s', session.number, session.report.format())
+        try:
+            while not session.finished:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                session.feed(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            log.exception('Session %d failed', session.number)
+        finally:
+            self.close_session(session)
+            log.info('Session %d closed, %d online', session.number, len(self.sessions))
+
+    def advance(self, session, dt):
+        try:
+            session.advance(dt)
+        except Exception:
+            log.exception('Session %d failed', session.number)
+            self.close_session(session)
+            return
+        if session.finished:
+            self.close_session(session)
+
+    async def clock(self):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(RESOLUTION)
+            now = time.monotonic()
+            dt, last = now - last, now
+            # Start from the next session each time, so nobody always goes first
+            self.sessions.rotate(-1)
+            sessions = list(self.sessions)
+            for i in range(0, len(sessions), BATCH):
+                for session in sessions[i:i + BATCH]:
+                    if not session.closed:
+                        self.advance(session, dt)
+                # Let input from other players through between batches
+                await asyncio.sleep(0)
+
+    async def start(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=BACKLOG)
+        self.port = server.sockets[0].getsockname()[1]
+        return server, asyncio.ensure_future(self.clock())
+
+    async def serve(self):
+        server, clock = await self.start()
+        log.info('Listening on %s:%d', self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            clock.cancel()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Commersant game server, play with telnet')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--height', type=int, default=SCREEN_SIZE[0])
+    parser.add_argument('--width', type=int, default=SCREEN_SIZE[1])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = Server(args.host, args.port, seed=args.seed, size=(args.height, args.width))
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,108 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import time
+
+from constants import *
+from models import DateCounter, Market, Secretary, StockExchange, TaxOffice, User
+from observer import DAILY, MONTHLY, Observable, Observer
+from prices import DEFAULT_MODEL, MODELS, get_model
+from rng import RandomRegistry
+
+
+class MonthClose(Observable, Observer):
+    # Month end settlement on the 1st: the stages run in order as one
+    # batch, then listeners get the date once, whatever the stages changed
+
+    def __init__(self, stages):
+        super(MonthClose, self).__init__()
+        # (name, function(date))
+        self.stages = stages
+
+    def update(self, date):
+        profiler = self.profiler
+        for name, stage in self.stages:
+            if profiler is None:
+                stage(date)
+                continue
+            started = time.perf_counter()
+            stage(date)
+            profiler.record('close.' + name, time.perf_counter() - started)
+        self.notify(date)
+
+
+class Simulation(object):
+
+    def __init__(self, name='Player', start_date=DATE, seed=None, price_model=None):
+        self.date = start_date
+        self.random = RandomRegistry(seed)
+        self.date_counter = DateCounter()
+        self.user = User(name, self.random)
+        self.user.date = start_date
+        self.bank = self.user.bank
+        self.price_model = get_model(price_model)
+        self.market = Market(self.random.stream('market'), self.price_model)
+        self.exchange = StockExchange(start_date, self.random.stream('exchange'), model=self.price_model)
+        self.tax = TaxOffice(self.user)
+        self.secretary = Secretary(self.random.stream('secretary'))
+
+        # The month closes before the user's instruments accrue: the new
+        # rates apply from the 1st and the tax takes the old month's profit
+        self.month_close = MonthClose((
+            ('bank', self.bank.update_rates),
+            ('market', self.market.update_prices),
+            ('tax', self.tax.charge),
+            ('exchange', self.exchange.update_prices),
+            ('secretary', self.secretary.update_heat),
+        ))
+        self.register(self.month_close, MONTHLY)
+        self.register(self.user)
+
+    def register(self, o, cadence=DAILY):
+        self.date_counter.register(o, cadence)
+
+    def tick(self):
+        self.date = self.date + TIMEDELTA
+        self.date_counter.notify(self.date)
+        return self.date
+
+    def place_order(self, good, side, amount, price=0):
+        # The player's order on the exchange, 0 for a market order
+        return self.exchange.place(self.user, good, side, amount, price or None)
+
+    def cancel_order(self, good, order_id):
+        return self.exchange.cancel(self.user, good, order_id)
+
+    def run(self, days):
+        # Fast-forward: no sleeping, no rendering
+        for _ in range(days):
+            self.tick()
+        return self.date
+
+    def run_until(self, end_date):
+        while self.date < end_date:
+            self.tick()
+        return self.date
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Headless Commersant simulation')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--name', default='Player')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--prices', choices=sorted(MODELS), default=DEFAULT_MODEL, help='Price model')
+    args = parser.parse_args()
+
+    simulation = Simulation(args.name, seed=args.seed, price_model=args.prices)
+    started = time.perf_counter()
+    simulation.run(args.days)
+    elapsed = time.perf_counter() - started
+    user = simulation.user
+    print('Дата: %s' % simulation.date)
+    print('Деньги: %s, прибыль: %s' % (user.total_money, user.profit))
+    print('Нефть: %s, земля: %s' % (user.property.oil, user.property.land))
+    print('%s дней за %.3f с' % (args.days, elapsed))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,437 @@
+# -*- encoding: utf8 -*-
+
+import os
+import struct
+import zlib
+
+from array import array
+from datetime import date
+
+from accrual import Instrument, RateHistory
+from constants import *
+from history import PriceSeries
+from ledger import Ledger
+from models import Property
+from orderbook import Order
+from observer import Observer, YEARLY
+from simulation import Simulation
+
+
+MAGIC = b'CMRS'
+VERSION = 6
+
+# Journal record types
+TICK = 0
+# First record: checksum of the snapshot the journal follows
+SNAPSHOT = 0xFF
+OPERATIONS = (
+    'new_deposit', 'new_loan', 'buy_car', 'buy_apartment', 'buy_oil',
+    'buy_land', 'sell_land', 'sell_oil', 'sell_apt', 'sell_car',
+    'place_order', 'cancel_order',
+)
+# Operations on the exchange rather than on the user
+EXCHANGE_OPERATIONS = ('place_order', 'cancel_order')
+# Argument types of each operation: d - number, s - string
+SIGNATURES = {
+    'new_deposit': 'dd',
+    'new_loan': 'dd',
+    'buy_car': 'sd',
+    'buy_apartment': 'sd',
+    'buy_oil': 'dd',
+    'buy_land': 'dd',
+    'sell_land': 'dd',
+    'sell_oil': 'dd',
+    'sell_apt': 'd',
+    'sell_car': 'd',
+    'place_order': 'dddd',
+    'cancel_order': 'dd',
+}
+# Record header: type and payload length
+RECORD = struct.Struct('<BH')
+NONE_LENGTH = 0xFFFF
+
+
+class StorageError(Exception):
+    pass
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def pack(self, fmt, *values):
+        self.buffer += struct.pack('<' + fmt, *values)
+
+    def string(self, s):
+        if s is None:
+            self.pack('H', NONE_LENGTH)
+            return
+        data = s.encode('utf8')
+        self.pack('H', len(data))
+        self.buffer += data
+
+    def date(self, d):
+        self.pack('I', d.toordinal() if d is not None else 0)
+
+    def number(self, n):
+        # Whole amounts stay ints after loading
+        if float(n).is_integer():
+            self.pack('Bq', 0, int(n))
+        else:
+            self.pack('Bd', 1, n)
+
+
+class Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        fmt = '<' + fmt
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def one(self, fmt):
+        return self.unpack(fmt)[0]
+
+    def string(self):
+        length = self.one('H')
+        if length == NONE_LENGTH:
+            return None
+        s = bytes(self.data[self.offset:self.offset + length]).decode('utf8')
+        self.offset += length
+        return s
+
+    def date(self):
+        ordinal = self.one('I')
+        return date.fromordinal(ordinal) if ordinal else None
+
+    def number(self):
+        kind = self.one('B')
+        return self.one('q' if kind == 0 else 'd')
+
+
+def _write_history(w, history):
+    w.pack('IH', history.first, len(history.rates))
+    w.pack('%dB' % len(history.rates), *history.rates)
+
+
+def _read_history(r):
+    first, count = r.unpack('IH')
+    history = RateHistory(DATE, 0)
+    history.first = first
+    history.rates = list(r.unpack('%dB' % count))
+    return history
+
+
+def _write_ledger(w, ledger):
+    instruments = [i for bucket in ledger.instruments.values() for i in bucket]
+    w.pack('I', len(instruments))
+    for i in instruments:
+        w.pack('q', i.principal)
+        w.date(i.start)
+        w.date(i.maturity)
+        w.pack('q', i.amount)
+
+
+def _read_ledger(r, history):
+    ledger = Ledger(history)
+    for _ in range(r.one('I')):
+        principal = r.one('q')
+        instrument = Instrument(principal, r.date(), r.date())
+        instrument.amount = r.one('q')
+        ledger.insert(instrument)
+    return ledger
+
+
+def _write_series(w, series):
+    # Only the stored span, the ring is rebuilt by appending it again
+    if series.last is None:
+        w.pack('Bii', series.years, 0, 0)
+        return
+    w.pack('Bii', series.years, series.first, len(series))
+    w.pack('%dI' % len(series), *(v or 0 for v in series.months(series.first, series.last)))
+
+
+def _read_series(r):
+    years, first, count = r.unpack('Bii')
+    series = PriceSeries(years)
+    for month_no, value in enumerate(r.unpack('%dI' % count), first):
+        if value:
+            series.append(month_no, value)
+    return series
+
+
+def _write_path(w, path):
+    # Current prices, regimes and the months already generated ahead
+    n = len(path)
+    w.pack('BBH', n, path.cursor, len(path.upcoming))
+    w.pack('%dI' % n, *path.prices)
+    w.pack('%dB' % n, *path.regimes)
+    w.pack('%dI' % len(path.upcoming), *path.upcoming)
+
+
+def _read_path(r, path):
+    n, path.cursor, count = r.unpack('BBH')
+    if n != len(path):
+        raise StorageError('Saved prices do not match the catalog')
+    path.prices[:] = array('I', r.unpack('%dI' % n))
+    path.regimes[:] = array('B', r.unpack('%dB' % n))
+    path.upcoming = array('I', r.unpack('%dI' % count))
+
+
+def _write_orders(w, book, user):
+    # The player's resting orders and the next order id
+    orders = book.owned(user)
+    w.pack('QI', book.next_id, len(orders))
+    for order in orders:
+        w.pack('QBIqq', order.id, order.side, order.price, order.amount, order.filled)
+
+
+def _read_orders(r, book, user):
+    book.next_id, count = r.unpack('QI')
+    for _ in range(count):
+        order_id, side, price, amount, filled = r.unpack('QBIqq')
+        order = Order(order_id, user, side, price, amount)
+        order.filled = filled
+        book.rest(order)
+
+
+def _write_benefit(w, benefit):
+    w.pack('qq', benefit.bought, benefit.sold)
+    w.number(benefit.benefit)
+
+
+def _read_benefit(r, benefit):
+    benefit.bought, benefit.sold = r.unpack('qq')
+    benefit.benefit = r.number()
+
+
+def dump_snapshot(simulation):
+    user = simulation.user
+    bank = simulation.bank
+    w = Writer()
+    w.buffer += MAGIC
+    w.pack('B', VERSION)
+
+    w.date(simulation.date)
+    w.pack('q', simulation.random.seed)
+    w.string(simulation.price_model.name)
+    w.string(user.name)
+    w.number(user.total_money)
+    w.number(user.profit)
+    w.pack('i??', user.scores, user.marriage, user.sick)
+    w.date(user.birthday)
+    w.string(user.property.apt)
+    w.string(user.property.car)
+    w.pack('qq', user.property.oil, user.property.land)
+    _write_benefit(w, user.oil_benefit)
+    _write_benefit(w, user.land_benefit)
+
+    w.pack('BB', bank.loan_rate, bank.deposit_rate)
+    _write_history(w, bank.loan_history)
+    _write_history(w, bank.deposit_history)
+    _write_ledger(w, user.deposits)
+    _write_ledger(w, user.loans)
+
+    _write_path(w, simulation.market.cars_path)
+    _write_path(w, simulation.market.apts_path)
+
+    exchange = simulation.exchange
+    _write_path(w, exchange.path)
+    for book in exchange.books:
+        _write_orders(w, book, user)
+    w.date(exchange.date)
+    _write_series(w, exchange.history.oil)
+    _write_series(w, exchange.history.land)
+    w.pack('B', simulation.tax.income_tax)
+    w.pack('B', simulation.secretary.heat)
+
+    streams = simulation.random.getstate()
+    w.pack('B', len(streams))
+    for name, (version, state, gauss) in sorted(streams.items()):
+        w.string(name)
+        w.pack('BH', version, len(state))
+        w.pack('%dI' % len(state), *state)
+        w.pack('?d', gauss is not None, gauss or 0.0)
+    return bytes(w.buffer)
+
+
+def load_snapshot(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise StorageError('Not a snapshot')
+    r = Reader(data)
+    r.offset = len(MAGIC)
+    if r.one('B') != VERSION:
+        raise StorageError('Unsupported snapshot version')
+
+    start = r.date()
+    seed = r.one('q')
+    price_model = r.string()
+    simulation = Simulation(r.string(), start_date=start, seed=seed, price_model=price_model)
+    user = simulation.user
+    bank = simulation.bank
+    user.total_money = r.number()
+    user.profit = r.number()
+    user.scores, user.marriage, user.sick = r.unpack('i??')
+    user.birthday = r.date()
+    # Older saves wrote None for a sold car or apartment
+    user.property.apt = r.string() or Property.NO_APARTMENT
+    user.property.car = r.string() or Property.NO_CAR
+    user.property.oil, user.property.land = r.unpack('qq')
+    _read_benefit(r, user.oil_benefit)
+    _read_benefit(r, user.land_benefit)
+
+    bank.loan_rate, bank.deposit_rate = r.unpack('BB')
+    bank.loan_history = _read_history(r)
+    bank.deposit_history = _read_history(r)
+    user.deposits = _read_ledger(r, bank.deposit_history)
+    user.loans = _read_ledger(r, bank.loan_history)
+
+    _read_path(r, simulation.market.cars_path)
+    _read_path(r, simulation.market.apts_path)
+    # Prices changed under any cached catalog rows
+    simulation.market.version += 1
+
+    exchange = simulation.exchange
+    _read_path(r, exchange.path)
+    for book in exchange.books:
+        _read_orders(r, book, user)
+    exchange.date = r.date()
+    exchange.history.oil = _read_series(r)
+    exchange.history.land = _read_series(r)
+    simulation.tax.income_tax = r.one('B')
+    simulation.secretary.heat = r.one('B')
+
+    streams = {}
+    for _ in range(r.one('B')):
+        name = r.string()
+        version, count = r.unpack('BH')
+        state = r.unpack('%dI' % count)
+        has_gauss, gauss = r.unpack('?d')
+        streams[name] = (version, state, gauss if has_gauss else None)
+    simulation.random.setstate(streams)
+    return simulation
+
+
+class Journal(Observer):
+    # Append-only log of ticks and transactions since the last snapshot
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+
+    def close(self):
+        self.file.close()
+
+    def _append(self, kind, payload):
+        self.file.write(RECORD.pack(kind, len(payload)) + payload)
+        self.file.flush()
+
+    def update(self, date):
+        self._append(TICK, struct.pack('<I', date.toordinal()))
+
+    def record(self, op, *args):
+        w = Writer()
+        for kind, arg in zip(SIGNATURES[op], args):
+            if kind == 's':
+                w.string(arg)
+            else:
+                w.number(arg)
+        self._append(OPERATIONS.index(op) + 1, bytes(w.buffer))
+
+    def reset(self, snapshot):
+        self.file.truncate(0)
+        self.file.seek(0)
+        self._append(SNAPSHOT, struct.pack('<I', zlib.crc32(snapshot)))
+
+
+def read_journal(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        kind, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            # Torn write at the end of the journal
+            return
+        r = Reader(data[offset:offset + length])
+        offset += length
+        if kind == TICK:
+            yield TICK, (date.fromordinal(r.one('I')),)
+        elif kind == SNAPSHOT:
+            yield SNAPSHOT, (r.one('I'),)
+        else:
+            op = OPERATIONS[kind - 1]
+            yield op, tuple(r.string() if t == 's' else r.number() for t in SIGNATURES[op])
+
+
+def save(simulation, path, journal=None):
+    data = dump_snapshot(simulation)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    if journal is not None:
+        journal.reset(data)
+
+
+def recover(path, journal_path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    simulation = load_snapshot(data)
+    for op, args in read_journal(journal_path):
+        if op == SNAPSHOT:
+            if args[0] != zlib.crc32(data):
+                # Left over from the snapshot before, this one already has
+                # it all: the save stopped before the journal was emptied
+                break
+        elif op == TICK:
+            if simulation.tick() != args[0]:
+                raise StorageError('Journal does not follow the snapshot')
+        elif op in EXCHANGE_OPERATIONS:
+            getattr(simulation, op)(*args)
+        else:
+            getattr(simulation.user, op)(*args)
+    return simulation
+
+
+def attach_journal(simulation, journal):
+    simulation.user.journal = journal
+    simulation.register(journal)
+
+
+class Autosave(Observer):
+
+    def __init__(self, simulation, path, journal):
+        self.simulation = simulation
+        self.path = path
+        self.journal = journal
+
+    def update(self, date):
+        save(self.simulation, self.path, self.journal)
+
+
+def open_game(name, path, journal_path):
+    # Restore the saved game if there is one and keep journaling from here.
+    # A save this version can't read is kept as .old and a new game starts.
+    simulation = None
+    if os.path.exists(path):
+        try:
+            simulation = recover(path, journal_path)
+        except StorageError:
+            for old in (path, journal_path):
+                if os.path.exists(old):
+                    os.replace(old, old + '.old')
+    if simulation is None:
+        simulation = Simulation(name)
+    journal = Journal(journal_path)
+    attach_journal(simulation, journal)
+    simulation.register(Autosave(simulation, path, journal), YEARLY)
+    return simulation, journal
@@ -0,0 +1,301 @@
+# -*- encoding: utf8 -*-
+
+import curses
+
+from collections import deque
+
+from constants import *
+
+
+# Frame statistics kept by the virtual terminal
+FRAME_HISTORY = 1024
+# Cells are shared between windows and sessions, the screen only ever
+# shows a handful of different ones
+_cells = {}
+
+
+def cell(ch, attr):
+    key = (ch, attr)
+    return _cells.setdefault(key, key)
+
+
+class CursesBackend(object):
+    # The real terminal: everything goes straight to curses
+
+    def __getattr__(self, name):
+        return getattr(curses, name)
+
+    def init_colors(self):
+        init_colors()
+
+
+class VirtualWindow(object):
+    # In-memory window. Windows made with derwin() share their parent's
+    # cells, like curses subwindows do.
+
+    def __init__(self, backend, height, width, begin_y, begin_x, parent=None):
+        self.backend = backend
+        self.height = height
+        self.width = width
+        self.begin_y = begin_y
+        self.begin_x = begin_x
+        self.parent = parent
+        if parent is None:
+            self.cells = [[(' ', 0)] * width for _ in range(height)]
+            self.origin = (0, 0)
+        else:
+            self.cells = parent.cells
+            self.origin = (parent.origin[0] + begin_y - parent.begin_y, parent.origin[1] + begin_x - parent.begin_x)
+        self.background = (' ', 0)
+        self.cursor = (0, 0)
+        self.delay = True
+        # Like curses, refresh() only copies a window changed since the last one
+        self.touched = True
+        # clear() was called: the next update repaints the whole screen
+        self.cleared = False
+
+    def _set(self, y, x, ch, attr):
+        if 0 <= y < self.height and 0 <= x < self.width:
+            self.cells[self.origin[0] + y][self.origin[1] + x] = cell(ch, attr)
+            self.touched = True
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, *args):
+        if len(args) >= 3:
+            y, x, text = args[:3]
+            attr = args[3] if len(args) > 3 else 0
+        else:
+            y, x = self.cursor
+            text = args[0]
+            attr = args[1] if len(args) > 1 else 0
+        self.backend.writes += 1
+        # The background colour only applies to text without its own
+        background = self.background[1]
+        if attr & curses.A_COLOR:
+            background &= ~curses.A_COLOR
+        attr |= background
+        for i, ch in enumerate(text):
+            self._set(y, x + i, ch, attr)
+        self.cursor = (y, x + len(text))
+
+    def bkgd(self, ch, attr=0):
+        if isinstance(ch, int):
+            ch = chr(ch)
+        old = self.background[0]
+        self.background = (ch, attr)
+        new = cell(ch, attr)
+        # Row slices instead of cell by cell, this runs for every new panel
+        for row, start, end in self._rows():
+            row[start:end] = [new if c[0] == old else c for c in row[start:end]]
+        self.touched = True
+
+    def _rows(self):
+        # (row, start, end) of the cells of this window
+        start = self.origin[1]
+        for y in range(self.origin[0], self.origin[0] + self.height):
+            row = self.cells[y]
+            yield row, start, min(start + self.width, len(row))
+
+    def box(self, vertical=None, horizontal=None):
+        attr = self.background[1]
+        for x in range(self.width):
+            self._set(0, x, '-', attr)
+            self._set(self.height - 1, x, '-', attr)
+        for y in range(self.height):
+            self._set(y, 0, '|', attr)
+            self._set(y, self.width - 1, '|', attr)
+
+    def erase(self):
+        new = cell(*self.background)
+        for row, start, end in self._rows():
+            row[start:end] = [new] * (end - start)
+        self.touched = True
+        self.cursor = (0, 0)
+
+    def clear(self):
+        # erase() plus clearok(), as in curses
+        self.erase()
+        self.cleared = True
+
+    def derwin(self, height, width, begin_y, begin_x):
+        return VirtualWindow(
+            self.backend, height, width, self.begin_y + begin_y, self.begin_x + begin_x, parent=self
+        )
+
+    def noutrefresh(self):
+        if self.cleared:
+            self.backend.repaint = True
+            self.cleared = False
+        if self.touched:
+            self.backend.stage(self)
+            self.touched = False
+
+    def refresh(self):
+        self.noutrefresh()
+        self.backend.doupdate()
+
+    def touchwin(self):
+        self.touched = True
+
+    def is_wintouched(self):
+        return self.touched
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = not flag
+
+    def getch(self):
+        # Like wgetch, only a window changed since its last refresh is refreshed
+        if self.touched:
+            self.refresh()
+        return self.backend.read_key(self.delay)
+
+
+class VirtualBackend(object):
+    # Screen buffer without a TTY: counts what each frame would send and
+    # reads keys from a scripted queue. With an output callback, every
+    # frame is also sent as ANSI escape sequences, e.g. to a network client.
+    ACS_CKBOARD = ord('#')
+    ACS_HLINE = ord('-')
+    ACS_VLINE = ord('|')
+
+    def __init__(self, height=40, width=120, keys=(), output=None):
+        self.height = height
+        self.width = width
+        self.output = output
+        self.pairs = {}
+        self.keys = deque()
+        self.feed(*keys)
+        self.screen = [[(' ', 0)] * width for _ in range(height)]
+        self.staged = [row[:] for row in self.screen]
+        # Set by a cleared window, the next frame sends every cell
+        self.repaint = False
+        # While set frames are not sent, the changes pile up in staged and
+        # go out together in the first frame after it is cleared
+        self.held = False
+        self.writes = 0
+        self.frames = deque(maxlen=FRAME_HISTORY)
+        self.stdscr = VirtualWindow(self, height, width, 0, 0)
+
+    def __getattr__(self, name):
+        # KEY_*, COLOR_* and A_* constants
+        return getattr(curses, name)
+
+    def feed(self, *keys):
+        for key in keys:
+            if isinstance(key, str):
+                self.keys.extend(ord(ch) for ch in key)
+            else:
+                self.keys.append(key)
+
+    def read_key(self, delay):
+        if self.keys:
+            return self.keys.popleft()
+        # A blocking read on an empty script cancels whatever is waiting
+        return KEY_ESC if delay else -1
+
+    def stage(self, window):
+        # Copy the window's rows, clipped to the screen
+        first = max(window.begin_x, 0)
+        last = min(window.begin_x + window.width, self.width)
+        if first >= last:
+            return
+        start = window.origin[1] + first - window.begin_x
+        for sy in range(max(window.begin_y, 0), min(window.begin_y + window.height, self.height)):
+            row = window.cells[window.origin[0] + sy - window.begin_y]
+            self.staged[sy][first:last] = row[start:start + last - first]
+
+    def _sgr(self, attr):
+        codes = ['0']
+        if attr & curses.A_BOLD:
+            codes.append('1')
+        pair = self.pairs.get((attr & curses.A_COLOR) >> 8)
+        if pair is not None:
+            codes.append('3%d' % pair[0])
+            codes.append('4%d' % pair[1])
+        return '\x1b[%sm' % ';'.join(codes)
+
+    def doupdate(self):
+        if self.held:
+            return
+        if self.repaint:
+            # What the terminal shows is forgotten, so nothing is skipped
+            self.screen = [[None] * self.width for _ in range(self.height)]
+            self.repaint = False
+        changed = 0
+        sent = 0
+        chunks = []
+        attr = None
+        for y in range(self.height):
+            staged = self.staged[y]
+            screen = self.screen[y]
+            if staged == screen:
+                continue
+            cursor = None
+            for x in range(self.width):
+                if staged[x] == screen[x]:
+                    continue
+                changed += 1
+                ch, cell_attr = staged[x]
+                if self.output is None:
+                    sent += len(ch.encode('utf8'))
+                    continue
+                if cursor != x:
+                    chunks.append('\x1b[%d;%dH' % (y + 1, x + 1))
+                if cell_attr != attr:
+                    chunks.append(self._sgr(cell_attr))
+                    attr = cell_attr
+                chunks.append(ch)
+                cursor = x + 1
+            self.screen[y] = staged[:]
+        if chunks:
+            data = ''.join(chunks).encode('utf8')
+            sent = len(data)
+            self.output(data)
+        self.frames.append({'writes': self.writes, 'cells': changed, 'bytes': sent})
+        self.writes = 0
+
+    def newwin(self, height, width, begin_y, begin_x):
+        return VirtualWindow(self, height, width, begin_y, begin_x)
+
+    def color_pair(self, n):
+        return n << 8
+
+    def init_pair(self, n, fg, bg):
+        self.pairs[n] = (fg, bg)
+
+    def init_colors(self):
+        init_colors(self.init_pair)
+
+    def curs_set(self, visibility):
+        pass
+
+    def echo(self):
+        pass
+
+    def noecho(self):
+        pass
+
+    def text(self):
+        return '\n'.join(''.join(ch for ch, attr in row).rstrip() for row in self.screen)
+
+
+class Terminal(object):
+    # Proxy to the current backend, so windows are created the same way
+    # on a real terminal and in memory
+
+    def __init__(self):
+        self.backend = CursesBackend()
+
+    def use(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+console = Terminal()
@@ -0,0 +1,114 @@
+# -*- encoding: utf8 -*-
+
+import json
+import time
+
+from array import array
+from collections import OrderedDict
+
+
+class StartupReport(object):
+    # Time to the first frame by stage. Stages follow each other:
+    # mark(stage) closes the stage running since the previous mark.
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+        self.stages = OrderedDict()
+
+    def mark(self, stage, now=None):
+        if now is None:
+            now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.started
+
+    def format(self):
+        stages = ', '.join('%s %.1f ms' % (stage, seconds * 1000) for stage, seconds in self.stages.items())
+        return 'startup %.1f ms: %s' % (self.total * 1000, stages)
+
+
+# Histogram buckets are powers of two of microseconds, the last one
+# takes everything from about 4 s up
+BUCKETS = 24
+# Samples per histogram generation
+WINDOW = 512
+
+
+class Histogram(object):
+    # Rolling histogram of durations. Samples only bump a bucket; after
+    # WINDOW of them the current generation becomes the previous one, so
+    # the figures always cover the last WINDOW to 2 * WINDOW samples.
+    __slots__ = ('current', 'previous', 'count', 'total', 'peak', 'old_count', 'old_total', 'old_peak')
+
+    def __init__(self):
+        self.current = array('I', [0] * BUCKETS)
+        self.previous = array('I', [0] * BUCKETS)
+        self.count = self.old_count = 0
+        self.total = self.old_total = 0.0
+        self.peak = self.old_peak = 0.0
+
+    def record(self, seconds):
+        bucket = min(int(seconds * 1000000).bit_length(), BUCKETS - 1)
+        self.current[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.peak:
+            self.peak = seconds
+        if self.count >= WINDOW:
+            self.previous, self.current = self.current, self.previous
+            self.current[:] = array('I', [0] * BUCKETS)
+            self.old_count, self.old_total, self.old_peak = self.count, self.total, self.peak
+            self.count = 0
+            self.total = self.peak = 0.0
+
+    def __len__(self):
+        return self.count + self.old_count
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the fraction, in seconds
+        wanted = fraction * len(self)
+        seen = 0
+        for bucket in range(BUCKETS):
+            seen += self.current[bucket] + self.previous[bucket]
+            if seen and seen >= wanted:
+                return (1 << bucket) / 1000000
+        return 0.0
+
+    def summary(self):
+        count = len(self)
+        peak = max(self.peak, self.old_peak)
+        # A bucket bound can be past the slowest sample
+        return {
+            'count': count,
+            'mean': (self.total + self.old_total) / count if count else 0.0,
+            'p50': min(self.percentile(0.5), peak),
+            'p99': min(self.percentile(0.99), peak),
+            'max': peak,
+        }
+
+
+class Profiler(object):
+    # Histograms of one session by name: update.<Observer>, show.<Panel>,
+    # frame and input
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(seconds)
+
+    def summaries(self):
+        return [(name, self.histograms[name].summary()) for name in sorted(self.histograms)]
+
+    def dump(self, path):
+        # One JSON line per dump, so the file is a time series
+        line = json.dumps({'time': time.time(), 'histograms': dict(self.summaries())})
+        with open(path, 'a') as f:
+            f.write(line + '\n')
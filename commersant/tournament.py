@@ -0,0 +1,219 @@
+# -*- encoding: utf8 -*-
+
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import time
+
+from constants import *
+from env import BUY_LAND, BUY_OIL, DEPOSIT, EPISODE_DAYS, NOOP, OBSERVATION, SELL_LAND, SELL_OIL, Env
+from prices import DEFAULT_MODEL, MODELS
+
+
+# Games sent to a worker at once: big enough to hide the pickling,
+# small enough to keep every core busy until the end
+SHARD_SIZE = 50
+
+MONEY = OBSERVATION.index('money')
+OIL = OBSERVATION.index('oil')
+LAND = OBSERVATION.index('land')
+OIL_PRICE = OBSERVATION.index('oil_price')
+LAND_PRICE = OBSERVATION.index('land_price')
+DAY = OBSERVATION.index('day')
+
+
+# Strategies take an observation of env.Env and return an action, or
+# None to wait. They run in worker processes, so they have to be
+# importable module level functions.
+
+def idle(observation):
+    return None
+
+
+def saver(observation):
+    # Half of the money on a three month deposit at the start of a month
+    if observation[DAY] == 1 and observation[MONEY] > 2000:
+        return DEPOSIT, 3, int(observation[MONEY] // 2)
+    return None
+
+
+def trader(observation):
+    # Buy the cheap half of the ranges, sell the expensive one
+    low, high = OIL_PRICE_RANGE
+    if observation[OIL_PRICE] < (low + high) / 2 and observation[MONEY] > observation[OIL_PRICE] * 20:
+        return BUY_OIL, 0, 10
+    if observation[OIL_PRICE] > (low + high) / 2 and observation[OIL]:
+        return SELL_OIL, 0, int(observation[OIL])
+    low, high = LAND_PRICE_RANGE
+    if observation[LAND_PRICE] < (low + high) / 2 and observation[MONEY] > observation[LAND_PRICE] * 4:
+        return BUY_LAND, 0, 2
+    if observation[LAND_PRICE] > (low + high) / 2 and observation[LAND]:
+        return SELL_LAND, 0, int(observation[LAND])
+    return NOOP, 0, 0
+
+
+STRATEGIES = {strategy.__name__: strategy for strategy in (idle, saver, trader)}
+
+
+def get_strategy(name):
+    # One of STRATEGIES, or module:function
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    module, _, function = name.partition(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def play(strategy, seed, days=EPISODE_DAYS, price_model=None):
+    # One full game, the final state of the player
+    env = Env(days=days, price_model=price_model)
+    observation = env.reset(seed)
+    done = False
+    while not done:
+        observation, reward, done = env.step(strategy(observation))
+    user = env.simulation.user
+    return {
+        'seed': seed,
+        'total_money': user.total_money,
+        'profit': user.profit,
+        'oil': user.property.oil,
+        'land': user.property.land,
+        'worth': env.net_worth(),
+    }
+
+
+def play_shard(task):
+    # Worker side: (strategy name, seeds, days, price model)
+    name, seeds, days, price_model = task
+    strategy = get_strategy(name)
+    return name, [play(strategy, seed, days, price_model) for seed in seeds]
+
+
+class Summary(object):
+    # Running count, mean, deviation and bounds of one figure, so results
+    # are folded in as they arrive (Welford)
+    __slots__ = ('count', 'mean', 'squares', 'low', 'high')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0
+        self.low = None
+        self.high = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+        self.low = value if self.low is None else min(self.low, value)
+        self.high = value if self.high is None else max(self.high, value)
+
+    @property
+    def deviation(self):
+        return math.sqrt(self.squares / (self.count - 1)) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {'mean': self.mean, 'std': self.deviation, 'min': self.low, 'max': self.high}
+
+
+FIGURES = ('total_money', 'profit', 'oil', 'land', 'worth')
+
+
+class Tournament(object):
+    # Every strategy plays the same seeds. Games are sharded over a
+    # process pool and results stream back shard by shard.
+
+    def __init__(self, strategies, seeds, days=EPISODE_DAYS, price_model=None, workers=None):
+        self.strategies = strategies
+        self.seeds = list(seeds)
+        self.days = days
+        self.price_model = price_model
+        self.workers = workers or os.cpu_count()
+        self.summaries = {name: {figure: Summary() for figure in FIGURES} for name in strategies}
+
+    def tasks(self):
+        for name in self.strategies:
+            for i in range(0, len(self.seeds), SHARD_SIZE):
+                yield name, self.seeds[i:i + SHARD_SIZE], self.days, self.price_model
+
+    def results(self):
+        # (strategy, game result) in task order whatever the worker count.
+        # The summaries add floats, so the order has to be the same for
+        # the same report; imap still keeps every worker busy.
+        if self.workers == 1:
+            shards = map(play_shard, self.tasks())
+            for name, games in shards:
+                for game in games:
+                    yield name, game
+            return
+        with multiprocessing.Pool(self.workers) as pool:
+            for name, games in pool.imap(play_shard, self.tasks()):
+                for game in games:
+                    yield name, game
+
+    def run(self, progress=None):
+        for name, game in self.results():
+            summary = self.summaries[name]
+            for figure in FIGURES:
+                summary[figure].add(game[figure])
+            if progress is not None:
+                progress(name, game)
+        return self.report()
+
+    def report(self):
+        return {
+            name: dict(
+                {'games': summary['worth'].count},
+                **{figure: summary[figure].as_dict() for figure in FIGURES}
+            )
+            for name, summary in self.summaries.items()
+        }
+
+
+def parse_seeds(text):
+    # "100" is seeds 0..99, "100:200" is 100..199
+    first, _, last = text.partition(':')
+    if not last:
+        return range(int(first))
+    return range(int(first), int(last))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Strategies against each other on the same seeds')
+    parser.add_argument('strategies', nargs='*', default=sorted(STRATEGIES),
+                        help='Names from %s or module:function' % ', '.join(sorted(STRATEGIES)))
+    parser.add_argument('--seeds', type=parse_seeds, default=range(1000), help='COUNT or FIRST:LAST')
+    parser.add_argument('--days', type=int, default=EPISODE_DAYS)
+    parser.add_argument('--workers', type=int, default=None, help='Processes, all cores by default')
+    parser.add_argument('--prices', choices=sorted(MODELS), default=DEFAULT_MODEL, help='Price model')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    for name in args.strategies:
+        get_strategy(name)
+    tournament = Tournament(args.strategies, args.seeds, args.days, args.prices, args.workers)
+    started = time.perf_counter()
+    report = tournament.run()
+    elapsed = time.perf_counter() - started
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    games = sum(result['games'] for result in report.values())
+    print('%s игр за %.1f с, %d процессов' % (games, elapsed, tournament.workers))
+    for name, result in sorted(report.items(), key=lambda item: -item[1]['worth']['mean']):
+        print('%-16s капитал %10.0f ± %-8.0f деньги %10.0f прибыль %9.0f нефть %6.1f земля %6.1f' % (
+            name,
+            result['worth']['mean'],
+            result['worth']['std'],
+            result['total_money']['mean'],
+            result['profit']['mean'],
+            result['oil']['mean'],
+            result['land']['mean'],
+        ))
+
+
+if __name__ == '__main__':
+    _main()
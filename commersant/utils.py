@@ -27,6 +27,11 @@ def construct_date(day=1, month=1, year=2017):
         return construct_date(day=day, month=month, year=year)
 
 
+def add_months(d, months):
+    month = d.month - 1 + months
+    return construct_date(day=d.day, month=month % 12 + 1, year=d.year + month // 12)
+
+
 def validate_int(i):
     return i.isdigit()
 
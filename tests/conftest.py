@@ -0,0 +1,7 @@
+# -*- encoding: utf8 -*-
+
+import os
+import sys
+
+# The game modules import each other by their flat names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'commersant'))
@@ -0,0 +1,70 @@
+# -*- encoding: utf8 -*-
+
+import random
+
+from datetime import date, timedelta
+from fractions import Fraction
+
+import pytest
+
+from accrual import Instrument, RateHistory, accrual_date, from_cents, month_number, to_cents
+from ledger import Ledger
+
+
+START = date(2017, 1, 1)
+
+
+def months(first, last):
+    d = first
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
+
+
+@pytest.mark.parametrize('day', [4, 15, 31])
+def test_closed_form_matches_month_by_month(day):
+    rnd = random.Random(day)
+    history = RateHistory(START, 5)
+    ledger = Ledger(history)
+    start = date(2017, 1, 3)
+    maturity = date(2018, 6, day if day < 31 else 30)
+    ledger.add(start, maturity, 1000)
+    instrument = ledger.instruments[maturity][0]
+    principal = instrument.principal
+
+    expected = Fraction(principal)
+    for d in months(start + timedelta(days=1), maturity):
+        if d.day == 1:
+            history.set_rate(d, rnd.randint(1, 20))
+            ledger.prune(d)
+        ledger.accrue(d)
+        month_no = month_number(d)
+        if d == accrual_date(month_no, instrument.day):
+            # One month of interest at this month's rate
+            expected *= Fraction(100 + history.rate(month_no - history.first), 100)
+        assert instrument.amount == int(expected)
+        assert instrument.value(d, history) == int(expected)
+    assert ledger.total == int(expected)
+
+
+def test_pruning_keeps_values():
+    rnd = random.Random(1)
+    full = RateHistory(START, 5)
+    pruned = RateHistory(START, 5)
+    instrument = Instrument(100000, date(2030, 5, 10), date(2031, 2, 10))
+    d = START
+    while d < date(2031, 2, 1):
+        d = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+        rate = rnd.randint(1, 20)
+        full.set_rate(d, rate)
+        pruned.set_rate(d, rate)
+        pruned.prune(min(month_number(d), month_number(instrument.start)))
+    assert len(pruned.rates) < 12 < len(full.rates)
+    assert instrument.value(date(2031, 2, 10), pruned) == instrument.value(date(2031, 2, 10), full)
+
+
+def test_whole_amounts_stay_ints():
+    assert from_cents(to_cents(1500)) == 1500
+    assert isinstance(from_cents(150000), int)
+    assert from_cents(150050) == 1500.5
+    assert from_cents(-150000) == -1500
@@ -0,0 +1,156 @@
+# -*- encoding: utf8 -*-
+
+import curses
+
+import pytest
+
+from constants import *
+from dialogs import Dialog, Prompt
+from dispatch import KEY_QUEUE_SIZE, Dispatcher, KeyHandler
+from main import Game, Screen
+from orderbook import SELL
+from simulation import Simulation
+from terminal import VirtualBackend, console
+
+
+class Recorder(KeyHandler):
+
+    def __init__(self):
+        self.keys = []
+
+    def default_key(self, key):
+        self.keys.append(key)
+
+
+@pytest.fixture
+def game():
+    backend = VirtualBackend(40, 120)
+    console.use(backend)
+    simulation = Simulation('Игрок', seed=3)
+    screen = Screen(backend.stdscr, simulation)
+    simulation.register(screen.date)
+    simulation.register(screen)
+    return Game(screen, simulation)
+
+
+def new_window():
+    backend = VirtualBackend(10, 40)
+    console.use(backend)
+    return backend.stdscr
+
+
+def press(game, *keys):
+    console.feed(*keys)
+    game.read_keys()
+
+
+def test_keys_go_to_the_top_handler():
+    root, first, second = Recorder(), Recorder(), Recorder()
+    dispatcher = Dispatcher(root)
+    dispatcher.push(first)
+    dispatcher.push(second)
+    assert dispatcher.top is second
+    dispatcher.feed(1)
+    dispatcher.dispatch()
+    # Whatever the handler opened goes with it
+    dispatcher.pop(first)
+    assert dispatcher.stack == [root]
+    dispatcher.feed(2)
+    dispatcher.dispatch()
+    assert (root.keys, first.keys, second.keys) == ([2], [], [1])
+    # The root stays
+    dispatcher.pop(root)
+    assert dispatcher.top is root
+    assert not dispatcher.dispatch()
+
+
+def test_full_queue_drops_the_newest_keys():
+    root = Recorder()
+    dispatcher = Dispatcher(root)
+    for key in range(KEY_QUEUE_SIZE):
+        assert dispatcher.feed(key)
+    assert not dispatcher.feed(KEY_QUEUE_SIZE)
+    while dispatcher.dispatch():
+        pass
+    assert root.keys == list(range(KEY_QUEUE_SIZE))
+
+
+def test_prompt_returns_its_text():
+    window = new_window()
+    answers = []
+    dispatcher = Dispatcher(Recorder())
+    prompt = dispatcher.push(Prompt(window, 1, 1, answers.append))
+    for key in b'12x':
+        prompt.handle_key(key)
+    prompt.handle_key(KEY_DEL)
+    prompt.handle_key(ord('3'))
+    prompt.handle_key(KEY_ENTER)
+    assert answers == ['123']
+    assert dispatcher.top is not prompt
+
+    dispatcher.push(Prompt(window, 1, 1, answers.append)).handle_key(ord('9'))
+    dispatcher.top.handle_key(KEY_ESC)
+    assert answers == ['123', '']
+
+
+def test_dialog_passes_on_the_key():
+    window = new_window()
+    keys = []
+    dispatcher = Dispatcher(Recorder())
+    dispatcher.push(Dialog(window, ' Вопрос ', ('Да [1] или нет [0]?',), keys.append))
+    dispatcher.feed(KEY_1)
+    dispatcher.dispatch()
+    assert keys == [KEY_1]
+    assert len(dispatcher) == 1
+
+
+def test_time_stands_still_while_a_panel_is_open(game):
+    simulation = game.simulation
+    press(game, curses.KEY_F4)
+    assert game.paused
+    assert game.dispatcher.top is game.screen.property
+    date = simulation.date
+    for _ in range(5):
+        game.step()
+    assert simulation.date == date
+    # Any key that sells nothing closes the panel
+    press(game, ord('x'))
+    assert not game.paused
+    game.step()
+    assert simulation.date > date
+
+
+def test_loan_through_dialog_and_prompts(game):
+    user = game.simulation.user
+    money = user.total_money
+    press(game, curses.KEY_F1, ord(' '))
+    assert isinstance(game.dispatcher.top, Dialog)
+    press(game, KEY_1)
+    assert isinstance(game.dispatcher.top, Prompt)
+    press(game, '500', KEY_ENTER, '3', KEY_ENTER)
+    assert user.get_loans() == 500
+    assert user.total_money == money + 500
+    assert len(game.dispatcher) == 1
+
+
+def test_escape_closes_the_panel_then_the_game(game):
+    press(game, curses.KEY_F3)
+    assert game.paused
+    press(game, KEY_ESC)
+    assert not game.paused
+    assert not game.finished
+    press(game, KEY_ESC)
+    assert game.finished
+
+
+def test_own_order_cancellation_is_shown(game):
+    simulation = game.simulation
+    exchange = simulation.exchange
+    simulation.user.property.oil = 10
+    price = exchange.oil_price + 1
+    simulation.place_order(exchange.OIL, SELL, 5, price)
+    press(game, curses.KEY_F3, KEY_N, '5', KEY_ENTER, str(price), KEY_ENTER)
+    assert isinstance(game.dispatcher.top, Dialog)
+    assert 'вашей же заявкой' in console.text()
+    press(game, ord(' '))
+    assert not game.paused
@@ -0,0 +1,90 @@
+# -*- encoding: utf8 -*-
+
+from orderbook import BUY, SELL, OrderBook
+from simulation import Simulation
+
+
+def settle(buy, sell, price, amount):
+    return None
+
+
+def resting(book, owner, side, price, amount):
+    order = book.order(owner, side, price, amount)
+    book.rest(order)
+    return order
+
+
+def test_best_price_fills_first():
+    book = OrderBook()
+    seller = object()
+    for price in (12, 10, 11):
+        resting(book, seller, SELL, price, 1)
+    fills = book.match(book.order(object(), BUY, None, 3), settle)
+    assert [fill.price for fill in fills] == [10, 11, 12]
+    assert len(book) == 0
+
+
+def test_earlier_order_fills_first_at_a_price():
+    book = OrderBook()
+    first = resting(book, object(), SELL, 10, 2)
+    second = resting(book, object(), SELL, 10, 2)
+    fills = book.match(book.order(object(), BUY, 10, 3), settle)
+    assert [(fill.sell, fill.amount) for fill in fills] == [(first, 2), (second, 1)]
+    assert first.id not in book
+    assert second.remaining == 1 and book.best(SELL) is second
+
+
+def test_bids_by_highest_price_then_time():
+    book = OrderBook()
+    low = resting(book, object(), BUY, 9, 1)
+    early = resting(book, object(), BUY, 11, 1)
+    late = resting(book, object(), BUY, 11, 1)
+    fills = book.match(book.order(object(), SELL, 9, 3), settle)
+    assert [fill.buy for fill in fills] == [early, late, low]
+
+
+def test_limit_stops_at_its_price():
+    book = OrderBook()
+    resting(book, object(), SELL, 10, 1)
+    expensive = resting(book, object(), SELL, 15, 1)
+    order = book.order(object(), BUY, 12, 2)
+    fills = book.match(order, settle)
+    assert [fill.price for fill in fills] == [10]
+    assert order.remaining == 1
+    assert book.best(SELL) is expensive
+
+
+def test_no_trading_with_yourself():
+    book = OrderBook()
+    owner = object()
+    other = resting(book, object(), SELL, 9, 1)
+    own = resting(book, owner, SELL, 10, 1)
+    order = book.order(owner, BUY, None, 2)
+    fills = book.match(order, settle)
+    # The incoming order is cancelled at the owner's own, the resting one stays
+    assert [fill.sell for fill in fills] == [other]
+    assert order.cancelled and order.remaining == 1
+    assert book.best(SELL) is own
+
+
+def test_own_crossing_order_is_not_placed():
+    simulation = Simulation('Игрок', seed=3)
+    exchange = simulation.exchange
+    user = simulation.user
+    user.property.oil = 10
+    ask, fills = simulation.place_order(exchange.OIL, SELL, 5, exchange.oil_price + 1)
+    assert ask.id in exchange.books[exchange.OIL]
+    money = user.total_money
+    bid, fills = simulation.place_order(exchange.OIL, BUY, 5, exchange.oil_price + 1)
+    assert bid.cancelled and not fills
+    assert bid.id not in exchange.books[exchange.OIL]
+    assert ask.id in exchange.books[exchange.OIL]
+    assert user.total_money == money
+
+
+def test_cancelled_level_is_skipped():
+    book = OrderBook()
+    cancelled = resting(book, object(), SELL, 10, 1)
+    kept = resting(book, object(), SELL, 11, 1)
+    book.cancel(cancelled.id)
+    assert book.best(SELL) is kept
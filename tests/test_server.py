@@ -0,0 +1,67 @@
+# -*- encoding: utf8 -*-
+
+import curses
+
+from constants import *
+from server import ESCAPE_DELAY, WRITE_BUFFER_LIMIT, KeyDecoder, Session
+
+
+def test_escape_sequence_split_across_reads():
+    decoder = KeyDecoder()
+    assert decoder.feed(b'a\x1bO') == [ord('a')]
+    assert decoder.feed(b'R') == [curses.KEY_F3]
+    assert decoder.feed(b'\x1b[1') == []
+    assert decoder.feed(b'5~\x1b[') == [curses.KEY_F5]
+    assert decoder.feed(b'A') == [curses.KEY_UP]
+
+
+def test_lone_escape_after_delay():
+    decoder = KeyDecoder()
+    assert decoder.feed(b'\x1b') == []
+    assert decoder.expire(ESCAPE_DELAY / 2) == []
+    assert decoder.expire(ESCAPE_DELAY) == [KEY_ESC]
+    assert decoder.expire(ESCAPE_DELAY) == []
+    # Not the start of any sequence
+    assert decoder.feed(b'\x1bx') == [KEY_ESC, ord('x')]
+
+
+def test_enter_split_across_reads():
+    decoder = KeyDecoder()
+    assert decoder.feed(b'1\r') == [ord('1'), KEY_ENTER]
+    assert decoder.feed(b'\n2') == [ord('2')]
+    assert decoder.feed(b'\r\n\r\0') == [KEY_ENTER, KEY_ENTER]
+    assert decoder.feed(b'\n') == [KEY_ENTER]
+
+
+class Transport(object):
+
+    def __init__(self):
+        self.buffered = 0
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.transport = Transport()
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+def test_slow_client_frames_are_merged():
+    writer = Writer()
+    session = Session(1, writer, seed=1)
+    sent = len(writer.frames)
+    writer.transport.buffered = WRITE_BUFFER_LIMIT + 1
+    for _ in range(20):
+        session.advance(session.game.tick)
+    assert len(writer.frames) == sent
+    # Everything that changed meanwhile goes out in one frame
+    writer.transport.buffered = 0
+    session.advance(0)
+    assert len(writer.frames) == sent + 1
+    assert session.simulation.date.strftime('%d-%b-%Y') in session.backend.text()
@@ -0,0 +1,98 @@
+# -*- encoding: utf8 -*-
+
+import os
+
+import pytest
+
+from orderbook import BUY, SELL
+from prices import MODELS
+from simulation import Simulation
+from storage import VERSION, Journal, attach_journal, dump_snapshot, load_snapshot, open_game, recover, save
+
+
+def play(simulation):
+    user = simulation.user
+    simulation.run(40)
+    user.new_deposit(500, 3)
+    user.new_loan(300, 2)
+    simulation.place_order(simulation.exchange.OIL, BUY, 5)
+    simulation.place_order(simulation.exchange.LAND, BUY, 2, 1)
+    simulation.run(75)
+    simulation.place_order(simulation.exchange.OIL, SELL, 2)
+    user.buy_car(simulation.market.cars.names[0], simulation.market.car_prices[0])
+    simulation.run(20)
+
+
+@pytest.mark.parametrize('seed', [7, -1, 2 ** 63 - 1])
+def test_snapshot_round_trip(seed):
+    simulation = Simulation('Игрок', seed=seed)
+    play(simulation)
+    data = dump_snapshot(simulation)
+    loaded = load_snapshot(data)
+    assert dump_snapshot(loaded) == data
+    assert loaded.random.seed == seed
+    assert loaded.date == simulation.date
+    assert loaded.user.total_money == simulation.user.total_money
+    assert loaded.user.get_deposits() == simulation.user.get_deposits()
+    assert loaded.user.property.car == simulation.user.property.car
+    # Both go on the same way
+    loaded.run(100)
+    simulation.run(100)
+    assert dump_snapshot(loaded) == dump_snapshot(simulation)
+
+
+@pytest.mark.parametrize('model', sorted(MODELS))
+def test_recover_replays_journal(tmp_path, model):
+    path = str(tmp_path / 'game.sav')
+    journal_path = str(tmp_path / 'game.journal')
+    simulation = Simulation('Игрок', seed=3, price_model=model)
+    journal = Journal(journal_path)
+    attach_journal(simulation, journal)
+    save(simulation, path, journal)
+    play(simulation)
+    assert dump_snapshot(recover(path, journal_path)) == dump_snapshot(simulation)
+
+    # A fresh snapshot empties the journal
+    save(simulation, path, journal)
+    simulation.run(10)
+    assert dump_snapshot(recover(path, journal_path)) == dump_snapshot(simulation)
+    journal.close()
+
+
+def test_sold_property_round_trip():
+    simulation = Simulation('Игрок', seed=5)
+    user = simulation.user
+    car = simulation.market.cars.names[0]
+    assert user.buy_car(car, simulation.market.car_price(car))
+    user.sell_car(simulation.market.price(car))
+    loaded = load_snapshot(dump_snapshot(simulation))
+    assert loaded.user.property.car == user.property.car == user.property.NO_CAR
+
+
+def test_recover_after_save_stopped_before_journal_reset(tmp_path):
+    path = str(tmp_path / 'game.sav')
+    journal_path = str(tmp_path / 'game.journal')
+    simulation = Simulation('Игрок', seed=3)
+    journal = Journal(journal_path)
+    attach_journal(simulation, journal)
+    save(simulation, path, journal)
+    play(simulation)
+    # The new snapshot is in place, the journal still holds the old days
+    save(simulation, path)
+    assert dump_snapshot(recover(path, journal_path)) == dump_snapshot(simulation)
+    journal.close()
+
+
+def test_open_game_starts_over_on_an_old_save(tmp_path):
+    path = str(tmp_path / 'game.sav')
+    journal_path = str(tmp_path / 'game.journal')
+    save(Simulation('Игрок', seed=3), path)
+    with open(path, 'r+b') as f:
+        data = bytearray(f.read())
+        data[4] = VERSION - 1
+        f.seek(0)
+        f.write(data)
+    simulation, journal = open_game('Новый', path, journal_path)
+    journal.close()
+    assert simulation.user.name == 'Новый'
+    assert os.path.exists(path + '.old')
@@ -0,0 +1,14 @@
+# -*- encoding: utf8 -*-
+
+import tournament
+
+from tournament import Tournament
+
+
+def test_report_does_not_depend_on_workers(monkeypatch):
+    # Small shards, so two workers finish them out of order
+    monkeypatch.setattr(tournament, 'SHARD_SIZE', 2)
+    strategies = ['idle', 'saver', 'trader']
+    single = Tournament(strategies, range(8), days=60, workers=1).run()
+    pooled = Tournament(strategies, range(8), days=60, workers=2).run()
+    assert pooled == single